@@ -0,0 +1,162 @@
+#!/usr/bin/python
+#
+# asyncCore.py
+# optional asyncio runtime for poolPi
+#
+# Runs every scheduler task and the 1-wire sampling as
+# cooperative tasks on one event loop instead of the
+# main loop plus the owTempThread thread. Calls that may
+# block on hardware (1-wire, pijuice, serial, redis) are
+# pushed to a bounded thread pool. Tasks that share a
+# resource are serialized by a per-resource lock, so one
+# slow device only stalls the tasks that use it.
+#
+# enable with config.USE_ASYNCIO
+#
+# version 1.0  18Oct26
+#
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import config as c
+import globalVars as gv
+import log
+import scheduler
+import owTempThread
+
+
+# module constants
+OFF     = c.OFF
+ON      = c.ON
+ERROR   = c.ERROR
+NOERROR = c.NOERROR
+
+ONEWIRE = "onewire"
+
+
+# module globals
+executor = None
+locks = {}
+
+
+
+# run a blocking call in the pool, one call at a time per resource
+async def callBlocking(resource, func, *args):
+    if (resource not in locks):
+        locks[resource] = asyncio.Lock()
+
+    async with locks[resource]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+
+
+# periodic task with its own deadline, late runs are caught up
+async def periodic(name, period, func, resource):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+
+    while (gv.loop):
+        try:
+            await callBlocking(resource, func)
+        except Exception as e:
+            log.log(log.ERROR, "task %s failed: %s" % (name, str(e)))
+
+        deadline += period
+        now = loop.time()
+        if (now - deadline > period * c.SCHED_MAX_CATCHUP):
+            log.log(log.WARNING, "task %s behind by %.1f secs, resyncing" % (name, now - deadline))
+            deadline = now
+
+        await asyncio.sleep(max(0.0, deadline - now))
+    return
+
+
+
+# 1-wire sampling, replaces the owTempThread thread
+async def sensorTask():
+    if (await callBlocking(ONEWIRE, owTempThread.init) != NOERROR):
+        return
+
+    await callBlocking(ONEWIRE, owTempThread.readAll)
+
+    while (gv.loop):
+        try:
+            delay = await callBlocking(ONEWIRE, owTempThread.poll)
+        except Exception as e:
+            log.log(log.ERROR, "1-wire poll failed: " + str(e))
+            delay = 1.0
+        await asyncio.sleep(delay)
+
+    log.log(log.CRITICAL, "1-wire task exiting")
+    return
+
+
+
+# runs the scheduler wake handlers (buttons, commands, one-shot
+# steps) when woken, when a step is due, or every SCHED_MAX_SLEEP secs
+async def wakeTask(wakeFlag):
+    while (gv.loop):
+        try:
+            await asyncio.wait_for(wakeFlag.wait(), scheduler.laterWait(c.SCHED_MAX_SLEEP))
+        except asyncio.TimeoutError:
+            pass
+        wakeFlag.clear()
+        await callBlocking(scheduler.CONTROL, scheduler.runWakeHandlers)
+    return
+
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(sensorTask())]
+
+    # wait for 1-wire init before starting control tasks
+    secs = 0
+    log.log(log.ALWAYS, "waiting on 1-wire init")
+    while (gv.owInitComplete == False):
+        await asyncio.sleep(1)
+        secs = secs + 1
+        if (secs > 60 or tasks[0].done()):
+            log.log(log.CRITICAL, "Timeout waiting for 1-wire Bus Init")
+            gv.loop = False
+            break
+
+    if (gv.loop):
+        wakeFlag = asyncio.Event()
+        scheduler.wakeHook = lambda: loop.call_soon_threadsafe(wakeFlag.set)
+        tasks.append(asyncio.create_task(wakeTask(wakeFlag)))
+
+        for entry in scheduler.getTasks():
+            tasks.append(asyncio.create_task(periodic(entry[scheduler.NAME], entry[scheduler.PERIOD],
+                                                      entry[scheduler.FUNC], entry[scheduler.RESOURCE])))
+        log.log(log.ALWAYS, "asyncio runtime running %d tasks" % len(tasks))
+
+    # gv.loop may be cleared from any task or thread
+    while (gv.loop):
+        await asyncio.sleep(1)
+
+    scheduler.wakeHook = None
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return
+
+
+
+# blocks until gv.loop is cleared
+def run():
+    global executor, locks
+
+    executor = ThreadPoolExecutor(max_workers=c.ASYNC_WORKERS)
+    locks = {}
+
+    try:
+        asyncio.run(main())
+    finally:
+        # don't wait on a call that is wedged in hardware
+        executor.shutdown(wait=False)
+
+    log.log(log.CRITICAL, "asyncio runtime exiting")
+    return
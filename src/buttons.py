@@ -11,6 +11,10 @@
 #      for now, if RED and BLUE buttons are detected simultaniously,
 #      a reboot() is called
 #
+# version 1.5  18Oct26  buttons are interrupt driven. gpiozero
+#      callbacks push timestamped PRESS, HOLD and CHORD events
+#      into a queue that the menus read, nothing busy-waits
+#
 #  Button Ref:
 #   Button 1 = GPIO Pin  6 Red / Modifier
 #   Button 2 = GPIO Pin 13 Yellow
@@ -19,11 +23,14 @@
 #
 
 import time
+import queue
+import threading
 import gpiozero as gz
 import log
 import config
 import lcd
-import menu
+import util
+import scheduler
 from subprocess import check_call
 import globalVars as gv
 
@@ -32,6 +39,11 @@ import globalVars as gv
 ERROR = 1
 NOERR = 0
 
+# event types
+PRESS = 1     # short press, reported on release
+HOLD  = 2     # held for hold_time
+CHORD = 3     # pressed while RED (the modifier) is down
+
 
 
 buttons = [0, 0, 0, 0]
@@ -48,10 +60,19 @@ YEL = 1
 GRN = 2
 BLU = 3
 
-Button_RED = buttons[RED]
-Button_YEL = buttons[YEL]
-Button_GRN = buttons[GRN]
-Button_BLU = buttons[BLU]
+Button_RED = RED
+Button_YEL = YEL
+Button_GRN = GRN
+Button_BLU = BLU
+
+
+# button events as (type, button, time.monotonic()) tuples,
+# filled from the gpiozero callback thread
+events = queue.Queue(config.BUTTON_QUEUE_SIZE)
+
+# a button that was held or used in a chord doesn't also report a press
+consumed = [False, False, False, False]
+lock = threading.Lock()
 
 
 
@@ -61,11 +82,12 @@ def init():
     for i in range(4):
         # set for input, pull-up on, 200ms debounce, 2 sec held time
         buttons[i] = gz.Button(config.BUTTON_PINS[i], pull_up = True, bounce_time = 0.2, hold_time = 2.0, hold_repeat=False)
-        log.log(log.DEBUG, "button[" + str(i) + "] init")
 
-        # can this be done without screwing up other stuff?
-        # detect button press using a faux interrupt
-        # buttons[i].when_pressed = menu.mainLoopButtons
+        # events are pushed from the gpiozero callback thread, nothing polls
+        buttons[i].when_pressed  = lambda b, i=i: pressed(i)
+        buttons[i].when_released = lambda b, i=i: released(i)
+        buttons[i].when_held     = lambda b, i=i: held(i)
+        log.log(log.DEBUG, "button[" + str(i) + "] init")
 
 
     # alternate shutdown option - hold down button connected to gpio 26 for 5 seconds
@@ -77,42 +99,93 @@ def init():
 
 
 
+def post(type, val):
+    try:
+        events.put_nowait((type, val, time.monotonic()))
+    except queue.Full:
+        log.log(log.WARNING, "button queue full, dropping event")
+
+    # let the main loop handle it now rather than at its next deadline
+    scheduler.wake()
+    return
+
+
+
+def pressed(val):
+    lcd.blink()
+
+    with lock:
+        consumed[val] = False
+
+        # if its not the red button, check if red button is also down
+        if (val != RED and buttons[RED].is_pressed):
+            consumed[val] = True
+            consumed[RED] = True
+            log.log(log.ALWAYS, "Button %d pressed with Alt" %val)
+            post(CHORD, val)
+
+            # reboot if red & blue buttons are down
+            if (val == BLU):
+                util.reboot()
+    return
+
+
+
+def released(val):
+    with lock:
+        if (consumed[val]):
+            consumed[val] = False
+            return
+    log.log(log.ALWAYS, "Button %d pressed" %val)
+    post(PRESS, val)
+    return
+
+
+
+def held(val):
+    with lock:
+        if (consumed[val]):
+            return
+        consumed[val] = True
+    log.log(log.ALWAYS, "Button %d held" %val)
+    post(HOLD, val)
+    return
+
+
+
+# returns the next (type, button, time) event or None.
+# waits up to timeout secs, 0 never blocks
+def getEvent(timeout=0):
+    try:
+        if (timeout > 0):
+            return events.get(True, timeout)
+        return events.get_nowait()
+    except queue.Empty:
+        return None
+
+
+
 # depricated - use readButtons
 def get():
     return readButtons()
 
 
+# returns the next pressed button (1-4) or 0, never blocks.
+# gv.buttonModifier is set if it was pressed with RED
 def readButtons():
-    global buttons, altFlag
-
-    # clear modifier flag
     gv.buttonModifier = False
 
-    # buttons are pulled up, so active low
-    for val in range(4):
-        if (buttons[val].is_pressed):
-            lcd.blink()
-
-            # if its not the red button, check if red button is also down
-            if (not (val == Button_RED)):
-                altFlag = buttons[RED].is_pressed
-
-            # wait for button up
-            while (buttons[val].is_pressed):
-                delay_ms(1)
+    # holds are only reported through getEvent()
+    e = getEvent()
+    while (e is not None and e[0] == HOLD):
+        e = getEvent()
 
-            if (altFlag == False):
-                log.log(log.ALWAYS, "Button %d pressed" %val)
-                return val + 1
-            else:
-                log.log(log.ALWAYS, "Button %d pressed with Alt" %val)
-                gv.buttonModifier = True
-                # reboot if red & blue buttons are down
-                if (val == Button_BLU):
-                    util.reboot()
-                return (val + 1)
+    if (e is None):
+        return 0
 
-    return 0
+    if (e[0] == CHORD):
+        gv.buttonModifier = True
+    return e[1] + 1
 
 
 
@@ -151,8 +224,9 @@ if __name__ == '__main__':
     val = 0
     loop = True
     while (loop):
-        val = readButtons()
-        if (val > 0):
+        e = getEvent(1.0)
+        if (e is not None and e[0] != HOLD):
+            val = e[1] + 1
             lcd.setCursor(2,1)
             lcd.printStr("Button " + str(val) + "  ")
             print ("Button " + str(val) + " is pressed")
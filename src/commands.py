@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# commands.py
+# command bus between the web/menus and the equipment
+#
+# Anything that changes equipment state from outside the
+# control loop (web requests) is submitted here instead of
+# calling equipment directly. The control loop is the only
+# thread that drains the queue, so it is the single owner of
+# the gpio and gv state. Each command gets an id and a
+# future the caller can wait on for its result.
+#
+# version 1.0  18Oct26
+#
+# version 1.1  18Oct26  a command that times out before it
+# starts is cancelled, so it never runs after the caller
+# has been told it timed out
+#
+
+import itertools
+import queue
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import config as c
+import log
+import scheduler
+
+
+# module constants
+ERROR   = c.ERROR
+NOERROR = c.NOERROR
+
+# ack status
+DONE    = "done"
+FAILED  = "error"
+TIMEOUT = "timeout"
+REFUSED = "refused"
+
+
+class QueueFull(Exception):
+    pass
+
+
+
+# module globals
+commandQueue = queue.Queue(c.COMMAND_QUEUE_SIZE)
+ids = itertools.count(1)
+
+
+
+# queue func(*args) for the control loop, returns the command dict
+def submit(name, func, *args):
+    cmd = {'id':     next(ids),
+           'name':   name,
+           'func':   func,
+           'args':   args,
+           'time':   time.monotonic(),
+           'future': Future()}
+
+    try:
+        commandQueue.put_nowait(cmd)
+    except queue.Full:
+        log.log(log.ERROR, "command queue full, refusing " + name)
+        cmd['future'].set_exception(QueueFull("command queue full"))
+        return cmd
+
+    log.log(log.DEBUG, "command %d queued: %s" % (cmd['id'], name))
+    scheduler.wake()
+    return cmd
+
+
+
+# run every queued command, called from the control loop only
+def process():
+    while (True):
+        try:
+            cmd = commandQueue.get_nowait()
+        except queue.Empty:
+            return
+
+        future = cmd['future']
+        if (not future.set_running_or_notify_cancel()):
+            continue
+
+        log.log(log.ALWAYS, "command %d: %s" % (cmd['id'], cmd['name']))
+        try:
+            future.set_result(cmd['func'](*cmd['args']))
+        except Exception as e:
+            log.log(log.ERROR, "command %d %s failed: %s" % (cmd['id'], cmd['name'], str(e)))
+            future.set_exception(e)
+
+
+
+# wait for cmd to run, returns an acknowledgement dict
+def wait(cmd, timeout=c.COMMAND_TIMEOUT):
+    ack = {'id': cmd['id'], 'name': cmd['name'], 'status': DONE, 'result': None}
+
+    future = cmd['future']
+    try:
+        try:
+            ack['result'] = future.result(timeout)
+        except FutureTimeout:
+            # too late, unless the control loop has already started it
+            if (future.cancel()):
+                log.log(log.WARNING, "command %d %s timed out, cancelled" % (cmd['id'], cmd['name']))
+                ack['status'] = TIMEOUT
+            else:
+                ack['result'] = future.result()
+
+    except QueueFull as e:
+        ack['status'] = REFUSED
+        ack['result'] = str(e)
+
+    except Exception as e:
+        ack['status'] = FAILED
+        ack['result'] = str(e)
+
+    ack['ms'] = int((time.monotonic() - cmd['time']) * 1000)
+    return ack
+
+
+
+def run(name, func, *args):
+    return wait(submit(name, func, *args))
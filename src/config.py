@@ -22,6 +22,10 @@ VERSION = ""
 ## enable simulator and/or flask
 START_FLASK = True
 USING_SIM   = True
+USE_ASYNCIO = False
+
+# max threads the asyncio runtime uses for blocking hardware calls
+ASYNC_WORKERS = 4
 
 
 ## options
@@ -46,7 +50,8 @@ VALVE_DRAIN_MODE = 3  # CCW, CW
 VALVE_UNK_MODE   = 4  # position not yet known
 
 
-## default schedule / timer settings
+## default schedule / timer settings, used until a schedule
+# is saved from the web page (SCHEDULE_FILE)
 # event [start hour, start mins, duration mins]
 event1 = [ 9, 0, 120]
 event2 = [19, 0, 60]
@@ -54,9 +59,34 @@ event2 = [19, 0, 60]
 # default ON duration
 DEFAULT_DURATION = 2
 
+# secs between spa start steps: pump, heater power, heater enable
+SPA_STEP_DELAY = 1.0
+
+# command bus: max queued commands, secs a web request waits
+# for the control loop to run its command
+COMMAND_QUEUE_SIZE = 16
+COMMAND_TIMEOUT    = 5
+
+# secs of no button presses before a menu returns to the status display
+MENU_TIMEOUT = 30
+
+## main loop task periods (secs)
+STATUS_PERIOD     = 1.0
+INFO_PERIOD       = 5.0
+THERMOSTAT_PERIOD = 10.0
+HOUSEKEEP_PERIOD  = 60.0
+
+# longest the scheduler will sleep, and how many periods
+# a task may fall behind before it is resynced
+SCHED_MAX_SLEEP   = 1.0
+SCHED_MAX_CATCHUP = 5
+
 ## file locations
 ROOT_DIR       = "/home/pi/"
 
+# saved pump schedule, replaces event1/event2 once it exists
+SCHEDULE_FILE  = ROOT_DIR + "schedule.json"
+
 # web
 WEB_DIR        = ROOT_DIR + "web/"
 WEB_FILE       = "index.html"
@@ -83,12 +113,45 @@ LED_RTN_PIN     =  8
 # buttons. and input
 ONEWIRE_PIN       = 4
 BUTTON_PINS       = [6, 13, 19, 26]
+BUTTON_QUEUE_SIZE = 16
 
 
 ## serial port
 BAUD = 57600
 PORT_NAME = "/dev/serial0"
 
+# lcd writer thread: max queued commands, secs before a stuck
+# write is abandoned, secs between reconnect attempts
+LCD_QUEUE_SIZE      = 32
+LCD_WRITE_TIMEOUT   = 2
+LCD_RECONNECT_DELAY = 5
+
+# default secs an lcd message stays over the status screen
+MESSAGE_TTL = 3
+
+
+## redis keys, controller state hash and its change counter
+REDIS_STATE_KEY   = "poolpi:state"
+REDIS_VERSION_KEY = "poolpi:version"
+
+# secs a web page may reuse the cached state without asking redis
+WEB_CACHE_TTL = 0.25
+
+# web server: "waitress" (if installed) or "werkzeug"
+WEB_SERVER           = "waitress"
+WEB_THREADS          = 8
+WEB_CONNECTION_LIMIT = 50
+WEB_CHANNEL_TIMEOUT  = 30
+WEB_MAX_STREAMS      = 5
+
+# secs to wait for the web server thread when exiting
+WEB_STOP_TIMEOUT     = 5
+
+# secs between state version checks for /events, and between
+# keepalive comments on an idle event stream
+WEB_WATCH_PERIOD = 0.5
+WEB_KEEPALIVE    = 15
+
 
 ## pijuice i2c bus & address
 PJ_ADDR = 0x14
@@ -134,6 +197,62 @@ CONTROLLER_TEMP = 1
 AIR_TEMP = 2
 
 ALLOWED_ERRORS = 10
+
+# quality of a sensor's last read (see globalVars.Reading), and the
+# oldest reading in secs each control decision will act on
+READ_NONE     = 0
+READ_GOOD     = 1
+READ_ERROR    = 2
+READ_REJECTED = 3
+READ_QUALITY_NAMES = ["none", "good", "error", "rejected"]
+
+SPA_TEMP_MAX_AGE        = 60
+AIR_TEMP_MAX_AGE        = 300
+CONTROLLER_TEMP_MAX_AGE = 900
+
+# saved sensor id for each role (spa, controller, air), the ids
+# above are the defaults. the bus is rescanned every
+# OW_RESCAN_PERIOD secs for new, replaced or recovered sensors
+OW_ROLES_FILE    = ROOT_DIR + "sensors.json"
+OW_RESCAN_PERIOD = 60.0
+
+# secs a 1-wire read may take beyond its conversion time before
+# it is abandoned and counted as an error
+OW_READ_TIMEOUT = 1.5
+
+# kernel w1 sysfs, and bulk conversion of all due sensors
+# at once (therm_bulk_read) when the bus has it
+W1_DEVICES_DIR = "/sys/bus/w1/devices/"
+OW_BULK_READ   = True
+
+# use a simulated bus in a temp dir (owSim.py) instead of the sensors
+OW_SIM = False
+
+# sensor sample periods (secs). spa: fast when in spa mode within
+# OW_SPA_NEAR_TEMP of the setpoint, idle when the system is off.
+# air: OW_AIR_FAST_PERIOD at FREEZE_TEMP rising to OW_AIR_PERIOD
+# at OW_AIR_BAND degrees above it. each is kept a few secs under
+# the sensor's *_TEMP_MAX_AGE
+OW_SPA_FAST_PERIOD = 5.0
+OW_SPA_PERIOD      = 20.0
+OW_SPA_IDLE_PERIOD = 55.0
+OW_SPA_NEAR_TEMP   = 2.0
+OW_AIR_FAST_PERIOD = 10.0
+OW_AIR_PERIOD      = 60.0
+OW_AIR_BAND        = 15.0
+OW_CNTRL_PERIOD    = 300.0
+
+# DS18B20 resolution (9-12 bits) by sensor: spa, controller, air.
+# 12 bits = 0.0625 C in 750 ms, 9 bits = 0.5 C in 94 ms
+OW_RESOLUTION = [12, 9, 10]
+
+# reading filters by sensor (see owFilter.py), leave a key out to
+# skip that stage. range in F, rate in F per sec, ema alpha 0-1
+OW_FILTERS = [
+    {'range': (30.0, 115.0),  'median': 3, 'rate': 1.0, 'ema': 0.6},
+    {'range': (0.0, 160.0),   'median': 3, 'rate': 0.5, 'ema': 0.3},
+    {'range': (-30.0, 130.0), 'median': 3, 'rate': 0.5, 'ema': 0.3},
+]
 TEMP_SENSOR_NAMES = ["Spa Temp", "Controller Temp", "Air Temp"]
 
 
@@ -145,6 +264,17 @@ HEATER_DELTA_TEMP = 0.50
 HEATER_MIN_TEMP = 90.0
 HEATER_MAX_TEMP = 104.0
 
+# spa thermostat: "bangbang" switches at setpoint / setpoint -
+# HEATER_DELTA_TEMP, "pid" enables the heater for output * PID_WINDOW
+# secs of each window (see pid.py). HEATER_LOCKOUT_TIME is the
+# minimum on and off time in both modes
+THERMOSTAT_MODE = "bangbang"
+PID_KP      = 0.25     # output per deg F below setpoint
+PID_KI      = 0.0002   # output per deg F per sec
+PID_KD      = 0.0      # output per deg F per sec of temp change
+PID_WINDOW  = 600      # secs
+PID_HISTORY = 48       # windows kept for /api/v1/thermostat
+
 ## event types (future)
 EVENT_NONE       = 0
 EVENT_PUMP_OFF   = 1
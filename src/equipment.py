@@ -15,6 +15,13 @@
 #
 # version 1.6 threaded  13June2020
 #
+# version 1.7  18Oct26  spaOn() no longer sleeps, the heater
+# power and heater enable steps follow the pump on the control
+# loop (scheduler.callLater), messages are lcd overlays
+#
+# version 1.8  18Oct26  pumpPower(OFF) shows its warnings in one
+# lcd message
+#
 #   Quick Ref:
 #   GPIO   Function
 #     22   Pump Power Relay
@@ -28,7 +35,6 @@
 #
 
 import sys
-import time
 
 import gpiozero as gz
 import log
@@ -38,6 +44,7 @@ import timer
 import lcd
 #import menu
 import owTemp as ow
+import scheduler
 from threading import Thread
 
 
@@ -73,6 +80,9 @@ sparePowerIO     = 0
 activityLedIO    = 0
 activityLedRtnIO = 0
 
+# set by spaOn until its heater steps have run, cleared by spaOff
+spaStarting = False
+
 
 
 def init():
@@ -124,18 +134,44 @@ def toggleLED():
 
 
 
+# pump on now, heater power and heater enable follow a step apart
 def spaOn(hours):
-    lcd.message("Turning on Spa... ")
+    global spaStarting
+
     log.log(log.ALWAYS, "SpaOn called with hours = " + str(hours))
-    time.sleep(1)
 
     pumpPower(ON)
-    lcd.message("Pump On")
-    time.sleep(1)
+    lcd.message("Turning on Spa... ", "Pump On")
+
+    spaStarting = True
+    scheduler.callLater(config.SPA_STEP_DELAY, "spaHeaterPower", lambda: spaHeaterPower(hours))
+    return
 
-    heaterPower(ON)
-    lcd.message("Heater On")
-    time.sleep(1)
+
+
+def spaHeaterPower(hours):
+    global spaStarting
+
+    # spa turned off since
+    if (spaStarting == False):
+        return
+
+    if (heaterPower(ON) != NOERROR):
+        spaStarting = False
+        return
+    lcd.message("Turning on Spa... ", "Heater On")
+
+    scheduler.callLater(config.SPA_STEP_DELAY, "spaHeaterEnable", lambda: spaHeaterEnable(hours))
+    return
+
+
+
+def spaHeaterEnable(hours):
+    global spaStarting
+
+    if (spaStarting == False):
+        return
+    spaStarting = False
 
     valveControl(VALVE_SPA_MODE)
 
@@ -149,6 +185,9 @@ def spaOn(hours):
 
 
 def spaOff():
+    global spaStarting
+
+    spaStarting = False
     lcd.message("Turning Off Spa... ")
     log.log(log.ALWAYS, "Turning Spa Off ")
 
@@ -202,13 +241,18 @@ def pumpPower(mode):
 
     elif (mode == OFF):
         # todo: only do this if user pushes button
+        # one overlay for both warnings, a second would replace the first
+        warnings = []
         if (gv.heatPower == ON):
             log.log(log.WARNING, "Turning off Pump with Heater ON!")
-            lcd.message("WARNING", "Turning off Pump with Heater ON!")
+            warnings.append("Pump off with Heater ON!")
 
         if (gv.systemMode == config.MANUAL or gv.systemMode == config.COOLDOWN):
             log.log(log.WARNING, "Heater may not have cooled down yet!")
-            lcd.message("WARNING", "Heater may not have cooled down yet!")
+            warnings.append("Heater may not be cooled!")
+
+        if (len(warnings) > 0):
+            lcd.message("WARNING", " ".join(warnings), ttl=config.MESSAGE_TTL * len(warnings))
 
         heaterEnable(OFF)
         heaterPower(OFF)
@@ -239,7 +283,6 @@ def heaterPower(mode):
 
         else:
             heaterPowerIO.on()
-            time.sleep(1)
             gv.heatPower = ON
             log.log(log.ALWAYS, "*** Heater power on ***")
             gv.systemMode = config.SPA_ON
@@ -372,7 +415,7 @@ def shutdown():
     sparePowerIO.off()
 
     try:
-        lcd.message("    System Off")
+        lcd.message("    System Off", ttl=0)
         lcd.setColor(0, 0, 255)
         lcd.closePort()
 
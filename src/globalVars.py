@@ -10,6 +10,8 @@
 #
 #
 
+from collections import namedtuple
+
 import config as c
 
 
@@ -62,11 +64,23 @@ airSensorEnabled = False
 owSpaErrors = 0
 owCntrlErrors = 0
 owAirErrors = 0
+owSpaRejects = 0
+owCntrlRejects = 0
+owAirRejects = 0
+
+# last reading of each sensor: value, time.monotonic() it was read
+# (0 = never), good reads so far, quality of the latest read
+Reading = namedtuple('Reading', ['value', 'time', 'count', 'quality'])
+NO_READING = Reading(0.0, 0.0, 0, c.READ_NONE)
+spaReading        = NO_READING
+controllerReading = NO_READING
+airReading        = NO_READING
 
 
 ## pijuice presence/status
 pjfwVersion = "---"
 powerStatus = UNK
+powerInput = UNK     # last pijuice reading, AC_POWER or BATTERY_POWER
 piJuicePresent = True
 pijuiceStatus = UNK
 
@@ -9,6 +9,23 @@
 #
 # version 1.3  04-25-19
 #
+# version 1.4  18Oct26  callers draw into a 20x4 shadow
+# framebuffer and flush() sends only the cells that changed
+# since the last flush
+#
+# version 1.5  18Oct26  commands are encoded as byte frames and
+# sent with one write(), repeated attribute commands are dropped
+#
+# version 1.6  18Oct26  after init a writer thread owns the serial
+# port. callers queue work and return, redundant frames coalesce,
+# write errors are logged and the writer reopens the port itself
+#
+# version 1.7  18Oct26  message() shows a timed overlay instead of
+# clearing the screen and sleeping
+#
+# version 1.8  18Oct26  blink() is skipped while the backlight is
+# off, and the writer ends a blink in the backlight state attrs hold
+#
 #
 #
 
@@ -16,6 +33,9 @@
 import serial
 import sys
 import time
+import threading
+import textwrap
+from collections import deque, OrderedDict
 
 import config as cfg
 import globalVars as gv
@@ -84,25 +104,143 @@ DEFAULT_CONTRAST           = 0xFF
 LCD_WIDTH                  = 20
 LCD_HEIGHT                 = 4
 
+# a cursor move costs 4 bytes, so changed runs closer together
+# than this are sent as one write
+MERGE_GAP                  = 4
 
 
-def lcdCmd(cmdlist):
+# shadow framebuffer, what callers have drawn and what the display
+# last received. rows and cols are 1 based like setCursor().
+# None in shown means the cell contents are unknown
+frame = [[" "] * LCD_WIDTH for r in range(LCD_HEIGHT)]
+shown = [[None] * LCD_WIDTH for r in range(LCD_HEIGHT)]
+cursorRow = 1
+cursorCol = 1
+
+# transient message drawn over the framebuffer until it expires
+# (time.monotonic), 0 = until clearMessage()
+overlay = None
+overlayExpires = 0.0
+
+# last value set for each display attribute (color, brightness,
+# contrast, backlight, gpo n), repeats are not resent
+attrs = {}
+attrFrames = {}
+
+# writer thread state. once the writer is running it is the only
+# thing that touches the port; callers just queue work under lock.
+# frame updates coalesce through the framebuffer (the writer sends
+# whatever the latest frame is), attribute commands coalesce per key
+lock = threading.RLock()
+wakeup = threading.Condition(lock)
+writer = None
+running = False
+dirty = False
+pendingCmds = deque()
+pendingAttrs = OrderedDict()
+BLINK = "blink"
+
+
+
+#---- protocol encoder ---------------------------------------------------
+
+# build one command frame: 0xFE, command, args
+def encode(cmd, *args):
+    return bytes([MATRIX_START_MSG, cmd] + list(args))
+
+
+def encodeCursor(row, col):
+    return encode(MATRIX_SETCURSOR_POSITION, col, row)
+
+
+# text must be bytes-clean, anything outside ascii becomes '?'
+def encodeText(s):
+    return s.encode("ascii", "replace")
+
+
+# constant frames
+CLEAR_FRAME         = encode(MATRIX_CLEAR)
+HOME_FRAME          = encode(MATRIX_HOME)
+CURSOR_OFF_FRAME    = encode(MATRIX_UNDERLINECURSOR_OFF)
+BACKLIGHT_ON_FRAME  = encode(MATRIX_DISPLAY_ON, 0x00)
+BACKLIGHT_OFF_FRAME = encode(MATRIX_DISPLAY_OFF)
+SETSIZE_FRAME       = encode(MATRIX_SETSIZE, LCD_WIDTH, LCD_HEIGHT)
+
+
+
+# every byte to the display goes through here. once the writer
+# thread is running the data is queued, otherwise it is written now
+def write(data):
     global port
 
-    for i in range(0, len(cmdlist)):
-         port.write(chr(cmdlist[i]))
+    if (len(data) == 0):
+        return
+
+    with lock:
+        if (running):
+            queueCmd(bytes(data))
+            return
+
+    port.write(bytes(data))
+    return
+
+
+
+def queueCmd(data):
+    # drop back to back repeats (clear, clear)
+    if (len(pendingCmds) > 0 and pendingCmds[-1] == data):
+        return
+
+    if (len(pendingCmds) >= cfg.LCD_QUEUE_SIZE):
+        log.log(log.WARNING, "lcd queue full, dropping oldest command")
+        pendingCmds.popleft()
+
+    pendingCmds.append(data)
+    wakeup.notify()
+    return
+
+
+
+def lcdCmd(cmdlist):
+    write(bytes(cmdlist))
     return
 
 
 
+# send frame unless key already has value on the display
+def setAttr(key, value, frame):
+    with lock:
+        if (attrs.get(key) == value):
+            return
+        attrs[key] = value
+        attrFrames[key] = frame
+
+        if (running):
+            # a newer value for the same attribute replaces a queued one
+            pendingAttrs.pop(key, None)
+            pendingAttrs[key] = frame
+            wakeup.notify()
+            return
+
+    write(frame)
+    return
+
+
+
+def openPort():
+    # open port at 57600bps with a timeout of 2 seconds, a write
+    # that can't finish in time raises instead of hanging
+    return serial.Serial(cfg.PORT_NAME, cfg.BAUD, timeout=2, write_timeout=cfg.LCD_WRITE_TIMEOUT)
+
+
+
 def init():
     global port
 
     log.log(log.INFO, "opening serial port")
 
     try:
-        # open port at 57600bps with a timeout of 2 seconds
-        port = serial.Serial(cfg.PORT_NAME, cfg.BAUD, timeout=2)
+        port = openPort()
 
     except Exception:
         log.log(log.ERROR, "error opening port")
@@ -111,17 +249,22 @@ def init():
     log.log(log.ALWAYS, "opened " + str(port.name))
     time.sleep(0.5)
 
+    clearFrame()
+    invalidate()
+    attrs.clear()
+    attrFrames.clear()
+
     # stopped working in latest update
     #port.flush()
 
-    # set screen size to 20 x 4
-    lcdCmd([MATRIX_START_MSG, MATRIX_SETSIZE, LCD_WIDTH, LCD_HEIGHT])
-
-    # cursor off
-    lcdCmd([MATRIX_START_MSG, MATRIX_UNDERLINECURSOR_OFF])
+    # set screen size to 20 x 4, cursor off
+    write(SETSIZE_FRAME + CURSOR_OFF_FRAME)
 
-    # clear screen & home
-    clearScreen()
+    # clear screen & home, the display needs a moment after a clear
+    write(CLEAR_FRAME + HOME_FRAME)
+    clearFrame()
+    for r in range(LCD_HEIGHT):
+        shown[r] = [" "] * LCD_WIDTH
     time.sleep(0.5)
 
     # set contrast
@@ -138,37 +281,276 @@ def init():
     for i in range(4):
         setGPIO(i, OFF)
 
+    startWriter()
     return NOERROR
 
 
 
+#---- writer thread ------------------------------------------------------
+
+def startWriter():
+    global writer, running
+
+    with lock:
+        if (running):
+            return
+        running = True
+
+    writer = threading.Thread(target=writerLoop, name="lcdWriter")
+    writer.daemon = True
+    writer.start()
+    log.log(log.ALWAYS, "lcd writer thread started")
+    return
+
+
+
+# queued work is sent before the writer exits
+def stopWriter():
+    global running
+
+    with lock:
+        running = False
+        wakeup.notify()
+
+    if (writer is not None and writer is not threading.current_thread()):
+        writer.join(cfg.LCD_WRITE_TIMEOUT + 1)
+    return
+
+
+
+def writerLoop():
+    global port, dirty
+
+    while (True):
+        with lock:
+            while (running and not (dirty or pendingCmds or pendingAttrs)):
+                # wake up when a message expires so the screen under it returns
+                wakeup.wait(messageWait(1.0))
+                if (checkMessage()):
+                    dirty = True
+
+            # when stopping, send what is already queued then quit
+            busy = (dirty or pendingCmds or pendingAttrs)
+            if (not running and (not busy or port is None)):
+                break
+
+            if (port is None):
+                chunks = []
+            else:
+                chunks = takePending()
+
+        # the port is only touched outside the lock, so a slow or
+        # wedged display never blocks a caller
+        try:
+            if (port is None):
+                reconnect()
+                continue
+
+            for c in chunks:
+                if (c == BLINK):
+                    port.write(BACKLIGHT_OFF_FRAME)
+                    time.sleep(0.1)
+                    # the backlight may have been turned off meanwhile
+                    if (attrs.get("backlight") == OFF):
+                        port.write(BACKLIGHT_OFF_FRAME)
+                    else:
+                        port.write(BACKLIGHT_ON_FRAME)
+                else:
+                    port.write(c)
+
+        except Exception as e:
+            log.log(log.ERROR, "lcd write failed, reconnecting: " + str(e))
+            try:
+                port.close()
+            except Exception:
+                pass
+            port = None
+
+    log.log(log.ALWAYS, "lcd writer thread exiting")
+    return
+
+
+
+# collect everything queued as a list of byte strings (and BLINK
+# markers), adjacent commands are joined into one write
+def takePending():
+    global dirty
+
+    chunks = []
+    buf = bytearray()
+
+    while (len(pendingCmds) > 0):
+        c = pendingCmds.popleft()
+        if (c == BLINK):
+            chunks.append(bytes(buf))
+            chunks.append(BLINK)
+            buf = bytearray()
+        else:
+            buf += c
+
+    for key in pendingAttrs:
+        buf += pendingAttrs[key]
+    pendingAttrs.clear()
+
+    if (dirty):
+        buf += diffFrame()
+        dirty = False
+
+    chunks.append(bytes(buf))
+    return [c for c in chunks if len(c) > 0]
+
+
+
+# reopen the port and restore the display, the frame is resent in full
+def reconnect():
+    global port, dirty
+
+    time.sleep(cfg.LCD_RECONNECT_DELAY)
+    try:
+        p = openPort()
+    except Exception:
+        log.log(log.DEBUG, "lcd reconnect failed")
+        return
+
+    with lock:
+        port = p
+        invalidate()
+        pendingCmds.appendleft(SETSIZE_FRAME + CURSOR_OFF_FRAME)
+        for key in attrFrames:
+            pendingAttrs[key] = attrFrames[key]
+        dirty = True
+
+    log.log(log.ALWAYS, "lcd reconnected")
+    return
+
+
+
+#---- shadow framebuffer -------------------------------------------------
+
+def clearFrame():
+    global frame
+    frame = [[" "] * LCD_WIDTH for r in range(LCD_HEIGHT)]
+    return
+
+
+
+# display contents unknown, next flush redraws every cell
+def invalidate():
+    global shown
+    shown = [[None] * LCD_WIDTH for r in range(LCD_HEIGHT)]
+    return
+
+
+
+# draw s into the framebuffer at row, col. text past the
+# right edge is clipped. nothing is sent until flush()
+def draw(row, col, s):
+    if (row < 1 or row > LCD_HEIGHT or col < 1):
+        return
+
+    s = str(s)
+    with lock:
+        line = frame[row - 1]
+        for i in range(len(s)):
+            if (col - 1 + i >= LCD_WIDTH):
+                break
+            line[col - 1 + i] = s[i]
+    return
+
+
+
+# draw s padded with spaces to width
+def drawLine(row, s, col=1, width=LCD_WIDTH):
+    draw(row, col, str(s).ljust(width))
+    return
+
+
+
+# send the cells that differ from what the display shows,
+# the whole update goes out as a single write()
+def flush():
+    global dirty
+
+    with lock:
+        if (running):
+            dirty = True
+            wakeup.notify()
+            return 0
+
+        buf = diffFrame()
+
+    write(buf)
+    return len(buf)
+
+
+
+# encode the changed runs and mark them as shown
+def diffFrame():
+    buf = bytearray()
+
+    checkMessage()
+    if (overlay is not None):
+        visible = overlay
+    else:
+        visible = frame
+
+    for r in range(LCD_HEIGHT):
+        line = visible[r]
+        last = shown[r]
+
+        col = 0
+        while (col < LCD_WIDTH):
+            if (line[col] == last[col]):
+                col += 1
+                continue
+
+            # extend the run, bridging short unchanged gaps
+            start = col
+            end = col + 1
+            col += 1
+            while (col < LCD_WIDTH and col - end < MERGE_GAP):
+                if (line[col] != last[col]):
+                    end = col + 1
+                col += 1
+
+            buf += encodeCursor(r + 1, start + 1)
+            buf += encodeText("".join(line[start:end]))
+            last[start:end] = line[start:end]
+            col = end
+
+    return buf
+
+
+
+#---- text output --------------------------------------------------------
+
 # print str no formatting
 def printStr(s):
-    global port
+    global cursorCol
 
-    port.write(s)
+    s = str(s)
+    with lock:
+        draw(cursorRow, cursorCol, s)
+        cursorCol += len(s)
+        flush()
     return
 
 
 # print str with trailing spaces to fill line
 # width = lcd width to use for adding spaces
 def printLine(s, width=LCD_WIDTH):
-    global port
-
     # add padding to the end
     while (len(s) < width):
         s = s + " "
 
-    port.write(s)
+    printStr(s)
     return
 
 
 # print str centered
 def printLineCenter(s, width=LCD_WIDTH):
-    global port
-
     # add spaces to beginning
-    for i in range((width - len(s)) / 2):
+    for i in range((width - len(s)) // 2):
         s = " " + s
 
     printLine(s, width)
@@ -177,15 +559,13 @@ def printLineCenter(s, width=LCD_WIDTH):
 
 # print int
 def printInt(i):
-    global port
-    port.write(str(i))
+    printStr(str(i))
     return
 
 
 # print float
 def printFloat(f):
-    global port
-    port.write('{:.1f}'.format(f))
+    printStr('{:.1f}'.format(f))
     return
 
 
@@ -193,38 +573,91 @@ def printFloat(f):
 
 # display message for x seconds
 def messageTimer(s1, timer=10):
-    clearScreen()
-    setCursor(2, 1)
-    printStr(s1)
-    time.sleep(timer)
-    clearScreen()
+    message("", s1, timer)
     return
 
 
 
-# display message
-def message(s1, s2=""):
-    clearScreen()
-    setCursor(1, 1)
-    printStr(s1)
-    setCursor(2, 1)
-    printStr(s2)
+# display message over the current screen for ttl secs (0 = until
+# clearMessage). long text wraps onto the following lines. the
+# caller never waits, whatever is drawn underneath keeps updating
+# and reappears when the message expires
+def message(s1, s2="", ttl=cfg.MESSAGE_TTL):
+    global overlay, overlayExpires
+
+    lines = textwrap.wrap(s1, LCD_WIDTH) or [""]
+    lines += textwrap.wrap(s2, LCD_WIDTH)
+
+    with lock:
+        overlay = [[" "] * LCD_WIDTH for r in range(LCD_HEIGHT)]
+        for r in range(min(len(lines), LCD_HEIGHT)):
+            for i in range(len(lines[r])):
+                overlay[r][i] = lines[r][i]
+
+        if (ttl > 0):
+            overlayExpires = time.monotonic() + ttl
+        else:
+            overlayExpires = 0.0
+        flush()
+    return
+
+
+
+def clearMessage():
+    global overlay
+
+    with lock:
+        if (overlay is not None):
+            overlay = None
+            flush()
     return
 
 
+
+def messageActive():
+    with lock:
+        checkMessage()
+        return (overlay is not None)
+
+
+
+# drop an expired message, returns True if the screen needs redrawing
+def checkMessage():
+    global overlay
+
+    if (overlay is None or overlayExpires == 0):
+        return False
+
+    if (time.monotonic() < overlayExpires):
+        return False
+
+    overlay = None
+    return True
+
+
+
+# secs until the current message expires, or limit
+def messageWait(limit):
+    if (overlay is None or overlayExpires == 0):
+        return limit
+    return max(0.0, min(limit, overlayExpires - time.monotonic()))
+
+
+
+# blanks the framebuffer, the cells are cleared by the next flush
+# so there is no hardware clear (and no wait for one)
 def clearScreen():
-    lcdCmd([MATRIX_START_MSG, MATRIX_CLEAR])
-    lcdCmd([MATRIX_START_MSG, MATRIX_HOME])
-    time.sleep(0.5)
+    with lock:
+        clearFrame()
+        setCursor(1, 1)
+        flush()
     return
 
 
 
 def clearLine(line):
-    global port
-
     setCursor(line, 1)
-    port.write(b"                    ")
+    printLine("")
     setCursor(line, 1)
     return
 
@@ -232,39 +665,51 @@ def clearLine(line):
 
 def setBacklight(state):
     if (state == ON):
-        lcdCmd([MATRIX_START_MSG, MATRIX_DISPLAY_ON, 0x00])
+        setAttr("backlight", ON, BACKLIGHT_ON_FRAME)
     elif (state == OFF):
-        lcdCmd([MATRIX_START_MSG, MATRIX_DISPLAY_OFF])
+        setAttr("backlight", OFF, BACKLIGHT_OFF_FRAME)
     else:
         log.log(log.ERROR, "Error - LCD Backlight value undefined")
     return
 
 
+# sets where the next print goes, the display cursor is moved by flush()
 def setCursor(row, col):
-    lcdCmd([MATRIX_START_MSG, MATRIX_SETCURSOR_POSITION, col, row])
+    global cursorRow, cursorCol
+
+    cursorRow = row
+    cursorCol = col
     return
 
 
 def setContrast(value):
-    lcdCmd([MATRIX_START_MSG, MATRIX_SET_CONTRAST, value])
+    setAttr("contrast", value, encode(MATRIX_SET_CONTRAST, value))
     return
 
 
 def setColor(r, g, b):
-    lcdCmd([MATRIX_START_MSG, MATRIX_RGBBACKLIGHT, r, g, b])
+    setAttr("color", (r, g, b), encode(MATRIX_RGBBACKLIGHT, r, g, b))
     return
 
 
 def setBrightness(b):
-    lcdCmd([MATRIX_START_MSG, MATRIX_SET_BRIGHTNESS, b])
+    setAttr("brightness", b, encode(MATRIX_SET_BRIGHTNESS, b))
     return
 
 
 def blink():
-	setBacklight(OFF)
-	time.sleep(0.1)
-	setBacklight(ON)
-	return
+    # the writer thread does the off/on so the caller doesn't sleep
+    with lock:
+        if (attrs.get("backlight") == OFF):
+            return
+        if (running):
+            queueCmd(BLINK)
+            return
+
+    setBacklight(OFF)
+    time.sleep(0.1)
+    setBacklight(ON)
+    return
 
 
 def setGPIO(gpio, value):
@@ -275,10 +720,10 @@ def setGPIO(gpio, value):
 
     # output inverted!
     if (value == ON):
-        lcdCmd([MATRIX_START_MSG, MATRIX_GPO_OFF, gpio])
+        setAttr("gpo%d" % gpio, ON, encode(MATRIX_GPO_OFF, gpio))
 
     elif (value == OFF):
-        lcdCmd([MATRIX_START_MSG, MATRIX_GPO_ON, gpio])
+        setAttr("gpo%d" % gpio, OFF, encode(MATRIX_GPO_ON, gpio))
 
     return
 
@@ -286,6 +731,8 @@ def setGPIO(gpio, value):
 
 def closePort():
     global port
+
+    stopWriter()
     try:
         port.close()
         log.log(log.INFO, "port closed")
@@ -4,6 +4,9 @@
 #
 #  version 1.1 10-01-18
 #
+#  version 1.2 18Oct26 initConsole() logs to the console
+#  only, for module tests run off the pi
+#
 # minimum log level = 3
 #
 
@@ -56,6 +59,22 @@ def init():
 
 
 
+# log to stderr instead of the log file
+def initConsole(level=INFO):
+    global logger
+
+    logger = logging.getLogger()
+    logger.setLevel(level)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+    logging.addLevelName(45, "ALWAYS")
+    logger.addHandler(handler)
+
+    return
+
+
+
 def log(level, msg):
     global logger
 
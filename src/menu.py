@@ -10,6 +10,13 @@
 #  version 1.51 04-07-20: fixed manual and
 #  and dev modes
 #
+#  version 1.6 18Oct26: menus are a state machine.
+#  mainLoopButtons() handles the buttons queued since
+#  the last call and returns right away, so the main
+#  loop keeps running timers and the thermostat while
+#  a menu is up. A menu left idle for MENU_TIMEOUT secs returns
+#  to the status display.
+#
 
 
 import time
@@ -47,70 +54,151 @@ BUTTON_2 = 2    # Yel - middle left
 BUTTON_3 = 3    # Grn - middle right
 BUTTON_4 = 4    # Blu - far right
 
+TEMP_STEP = 1.0
+
+# menu states
+STATUS      = 0
+SPA         = 1
+PUMP        = 2
+UTIL        = 3
+SPA_TEMP    = 4
+MANUAL      = 5
+PUMP_CTRL   = 6
+HEATER_CTRL = 7
+VALVE_CTRL  = 8
+DEV_TOOLS   = 9
+CONFIRM     = 10
 
 
 
 #module globals
+state = STATUS
+hours = 0
+lastActivity = 0.0
+
+# pending confirm() request
+confirmMessage = ""
+confirmAction = None
+confirmReturn = STATUS
 
 
 
 #---- top/main menu -------------------------------------------------------
 
 def statusDisplay():
-    # to minimize flicker, draw each line rather than entire screen
-    # each line must be the full lcd width to prevent stray chars
-    # use lcd.printLine($, starting pos) to pad each section
+    # menus own the screen while they are up
+    if (state != STATUS):
+        return
 
+    # draw into the lcd framebuffer, flush() only sends the
+    # cells that changed (usually just the seconds digit)
     timeStr = time.strftime("%I:%M:%S", time.localtime())
     # get rid of leading zero
     if (timeStr[0] == "0"):
         timeStr = timeStr[1:8]
 
-    lcd.setCursor(1, 1)
-    lcd.printLine(timeStr, 10)
-
-    lcd.setCursor(1, 10)
-    lcd.printLine("Mode:" + c.MODE_NAMES[gv.systemMode], 10)
+    lcd.drawLine(1, timeStr, 1, 10)
+    lcd.drawLine(1, "Mode:" + c.MODE_NAMES[gv.systemMode], 11, 10)
 
-    lcd.setCursor(2, 1)
-    lcd.printLine("Pump:" + modeToStr(gv.pumpPower), 10)
-
-    lcd.setCursor(2,10)
+    lcd.drawLine(2, "Pump:" + modeToStr(gv.pumpPower), 1, 10)
     #if (gv.powerStatus == power.AC_POWER):
     if (gv.pumpPower == ON):
-        lcd.printLine(timer.getTimeRemaining(), 10)
+        lcd.drawLine(2, timer.getTimeRemaining(), 11, 10)
     else:
-        lcd.printLine("Bat=" + str(power.getChargeLevel()) + "%", 10)
-
-    lcd.setCursor(3, 1)
-    lcd.printLine("Heat:" + modeToStr(gv.heatPower), 10)
+        lcd.drawLine(2, "Bat=" + str(gv.charge) + "%", 11, 10)
 
-    lcd.setCursor(3, 10)
+    lcd.drawLine(3, "Heat:" + modeToStr(gv.heatPower), 1, 10)
     if (not (gv.systemMode == c.SYS_OFF)):
-        lcd.printLine("Temp:" + str(gv.spaTemp), 10)
+        lcd.drawLine(3, "Temp:" + str(gv.spaTemp), 11, 10)
     else:
-        lcd.printLine("Temp:" + str(gv.airTemp), 10)
+        lcd.drawLine(3, "Temp:" + str(gv.airTemp), 11, 10)
 
-    lcd.setCursor(4, 1)
-    lcd.printLine("Menu  Temp Pump  Spa")
+    lcd.drawLine(4, "Menu  Temp Pump  Spa")
+    lcd.flush()
     return
 
 
 
-
+# called from the main loop, never blocks waiting for a button
 def mainLoopButtons():
+    now = time.monotonic()
+
+    e = buttons.getEvent()
+    if (e is None):
+        # idle in a menu too long?
+        if (state != STATUS and (now - lastActivity) > c.MENU_TIMEOUT):
+            log.log(log.INFO, "menu timeout, returning to status display")
+            setState(STATUS)
+        return
 
-    # check for button down
-    b = buttons.readButtons()
-    if (b == 0):
+    while (e is not None):
+        handleEvent(e)
+        e = buttons.getEvent()
+    return
+
+
+
+def handleEvent(e):
+    global lastActivity
+
+    type, val, t = e
+    lastActivity = time.monotonic()
+
+    # a button press ends a timed message early
+    lcd.clearMessage()
+
+    # holding RED backs out of any menu
+    if (type == buttons.HOLD):
+        if (val == buttons.RED and state != STATUS):
+            setState(STATUS)
         return
 
+    gv.buttonModifier = (type == buttons.CHORD)
+    b = val + 1
+
+    if (state in HANDLERS):
+        HANDLERS[state](b)
+    else:
+        log.log(log.ERROR, "invalid menu state %d" % state)
+        setState(STATUS)
+    return
+
+
+
+def setState(newState):
+    global state, lastActivity
+
+    state = newState
+    lastActivity = time.monotonic()
+    drawState()
+    return
+
+
+
+def drawState():
+    if (state in DRAW):
+        DRAW[state]()
+    return
+
+
+
+# show a message over the current menu for secs
+def showMessage(s1, secs, s2=""):
+    lcd.message(s1, s2, secs)
+    return
+
+
+
+def statusButtons(b):
+    global hours
+
     # spa button
     if (b == BUTTON_4):
         if (gv.systemMode == c.SPA_ON):
             equipment.spaOff()
         else:
-            spaMenuLoop()
+            hours = c.DEFAULT_DURATION
+            setState(SPA)
 
     # pump button
     elif (b == BUTTON_3):
@@ -118,15 +206,16 @@ def mainLoopButtons():
             equipment.pumpPower(OFF)
             timer.clearPumpOffEvent()
         else:
-            pumpMenuLoop()
+            hours = 1
+            setState(PUMP)
 
     # temp button
     elif (b == BUTTON_2):
-        tempAdjLoop()
+        setState(SPA_TEMP)
 
     # util menu button
     elif (b == BUTTON_1):
-        utilMenuLoop()
+        setState(UTIL)
 
     else:
         log.log(log.ERROR, "invalid input for mainLoopButtons")
@@ -150,37 +239,30 @@ def spaMenu(hours):
 
 
 
-def spaMenuLoop():
-    hours = c.DEFAULT_DURATION
-    exit = False
-    spaMenu(hours)
-
-    # handle button press for spa menu
-    b = 0
-    while(exit == False):
-        b = buttons.readButtons()
+def spaButtons(b):
+    global hours
 
-        # back button
-        if (b == BUTTON_1):
-            exit = True
+    # back button
+    if (b == BUTTON_1):
+        setState(STATUS)
 
-        # start button
-        elif (b == BUTTON_4):
-            equipment.spaOn(hours)
-            exit = True
+    # start button
+    elif (b == BUTTON_4):
+        setState(STATUS)
+        equipment.spaOn(hours)
 
-        # less button
-        elif (b == BUTTON_2):
-            if (hours < 12):
-                hours += 1
-            spaMenu(hours)
+    # more button
+    elif (b == BUTTON_2):
+        if (hours < 12):
+            hours += 1
+        spaMenu(hours)
 
-        # more button
-        elif (b == BUTTON_3):
-            hours -= 1
-            if (hours < 1):
-                hours = 1
-            spaMenu(hours)
+    # less button
+    elif (b == BUTTON_3):
+        hours -= 1
+        if (hours < 1):
+            hours = 1
+        spaMenu(hours)
     return
 
 
@@ -201,39 +283,32 @@ def pumpMenu(hours):
 
 
 
-def pumpMenuLoop():
-    hours = 1
-    exit = False
-    pumpMenu(hours)
-
-    # handle button press for spa menu
-    b = 0
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # back button
-        if (b == BUTTON_1):
-            exit = True
-
-        # start button
-        elif (b == BUTTON_4):
-            # turn pump on
-            timer.setPumpOffEvent(hours, 0)
-            equipment.pumpPower(ON)
-            gv.systemMode = c.MANUAL
-            exit = True
-
-        # less button
-        elif (b == BUTTON_2):
-            if (hours < 12):
-                hours += 1
-            pumpMenu(hours)
-
-        # more button
-        elif (b == BUTTON_3):
-            if (hours > 1):
-                hours -= 1
-            pumpMenu(hours)
+def pumpButtons(b):
+    global hours
+
+    # back button
+    if (b == BUTTON_1):
+        setState(STATUS)
+
+    # start button
+    elif (b == BUTTON_4):
+        # turn pump on
+        setState(STATUS)
+        timer.setPumpOffEvent(hours, 0)
+        equipment.pumpPower(ON)
+        gv.systemMode = c.MANUAL
+
+    # more button
+    elif (b == BUTTON_2):
+        if (hours < 12):
+            hours += 1
+        pumpMenu(hours)
+
+    # less button
+    elif (b == BUTTON_3):
+        if (hours > 1):
+            hours -= 1
+        pumpMenu(hours)
     return
 
 
@@ -257,32 +332,23 @@ def utilMenu():
 
 
 
-def utilMenuLoop():
-    exit = False
-    utilMenu()
-
-    # handle button press for util menu
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # clean spa button
-        if (b == BUTTON_4):
-            cleanSpa()
-            exit = True
+def utilButtons(b):
+    # clean spa button
+    if (b == BUTTON_4):
+        setState(STATUS)
+        cleanSpa()
 
-        # spa temp button
-        elif (b == BUTTON_3):
-            setSpaTempLoop()
-            exit = True
+    # spa temp button
+    elif (b == BUTTON_3):
+        setState(SPA_TEMP)
 
-        # manual control button
-        elif (b == BUTTON_2):
-            manualControlLoop()
-            utilMenu()
+    # manual control button
+    elif (b == BUTTON_2):
+        setState(MANUAL)
 
-        # back button
-        elif (b == BUTTON_1):
-            exit = True
+    # back button
+    elif (b == BUTTON_1):
+        setState(STATUS)
 
     return
 
@@ -297,13 +363,10 @@ def cleanSpa():
     # turn pump on
     timer.setPumpOffEvent(1, 0)
     equipment.pumpPower(ON)
-    v.systemMode = c.MANUAL
+    gv.systemMode = c.MANUAL
     # set valves to drain spa mode
-    lcd.clearScreen()
-    lcd.setCursor(1,1)
-    lcd.printLineCenter("Setting Valves")
-    equipment.setValves(c.VALVE_DRAIN_MODE)
-    time.sleep(5)
+    equipment.valveControl(c.VALVE_DRAIN_MODE)
+    showMessage("Setting Valves", 5)
     return
 
 
@@ -325,36 +388,27 @@ def setSpaTempMenu():
 
 
 
-def setSpaTempLoop():
-    setSpaTempMenu()
-    exit = False
-
-    # handle button press for spa menu
-    b = 0
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # back button
-        if (b == BUTTON_1):
-            exit = True
+def setSpaTempButtons(b):
+    # back button
+    if (b == BUTTON_1):
+        setState(STATUS)
 
-        # + button
-        elif (b == BUTTON_2):
-            if (temp < 105):
-                gv.spaSetPoint += 1.0
-                setSpaTempMenu()
+    # + button
+    elif (b == BUTTON_2):
+        if (gv.spaSetPoint < c.HEATER_MAX_TEMP):
+            gv.spaSetPoint += TEMP_STEP
+            setSpaTempMenu()
 
-        # - button
-        elif (b == BUTTON_3):
-            if (temp > 90):
-                gv.spaSetPoint -= TEMP_STEP
-                setSpaTempMenu()
+    # - button
+    elif (b == BUTTON_3):
+        if (gv.spaSetPoint > c.HEATER_MIN_TEMP):
+            gv.spaSetPoint -= TEMP_STEP
+            setSpaTempMenu()
 
-        # cancel
-        elif (b == BUTTON_4):
-            exit = True
+    # cancel
+    elif (b == BUTTON_4):
+        setState(STATUS)
 
-        # end while
     return
 
 
@@ -373,35 +427,25 @@ def manualControlMenu():
     return
 
 
-def manualControlLoop():
-    exit = False
-    manualControlMenu()
-
-    # handle button press
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # option 1
-        if (b == BUTTON_4):
-            valveControlLoop()
-            manualControlMenu()
+def manualControlButtons(b):
+    # option 1
+    if (b == BUTTON_4):
+        setState(VALVE_CTRL)
 
-        # option 2
-        elif (b == BUTTON_3):
-            heaterControlLoop()
-            manualControlMenu()
+    # option 2
+    elif (b == BUTTON_3):
+        setState(HEATER_CTRL)
 
-        # option 3
-        elif (b == BUTTON_2):
-            pumpControlLoop()
-            manualControlMenu()
+    # option 3
+    elif (b == BUTTON_2):
+        setState(PUMP_CTRL)
 
-        # Back Button
-        elif (b == BUTTON_1):
-            exit = True
+    # Back Button
+    elif (b == BUTTON_1):
+        setState(UTIL)
 
     return
-    # end manual control loop
+    # end manual control menu
 
 
 
@@ -421,34 +465,27 @@ def pumpControlMenu():
     return
 
 
-def pumpControlLoop():
-    exit = False
-    pumpControlMenu()
-
-    # handle button press
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # option 1
-        if (b == BUTTON_4):
-            equipment.pumpPower(ON)
-            pumpControlMenu()
+def pumpControlButtons(b):
+    # option 1
+    if (b == BUTTON_4):
+        equipment.pumpPower(ON)
+        pumpControlMenu()
 
-        # option 2
-        elif (b == BUTTON_3):
-            equipment.pumpPower(OFF)
-            pumpControlMenu()
+    # option 2
+    elif (b == BUTTON_3):
+        equipment.pumpPower(OFF)
+        pumpControlMenu()
 
-        # option 3
-        elif (b == BUTTON_2):
-            pass
+    # option 3
+    elif (b == BUTTON_2):
+        pass
 
-        # Back Button
-        elif (b == BUTTON_1):
-            exit = True
+    # Back Button
+    elif (b == BUTTON_1):
+        setState(MANUAL)
 
     return
-    # end manual control loop
+    # end pump control menu
 
 
 
@@ -467,39 +504,32 @@ def heaterControlMenu():
     return
 
 
-def heaterControlLoop():
-    exit = False
-    heaterControlMenu()
-
-    # handle button press
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # option 1
-        if (b == BUTTON_4):
-            equipment.heaterPower(ON)
-            heaterControlMenu()
+def heaterControlButtons(b):
+    # option 1
+    if (b == BUTTON_4):
+        equipment.heaterPower(ON)
+        heaterControlMenu()
 
-        # option 2
-        elif (b == BUTTON_3):
-            equipment.heaterPower(OFF)
-            heaterControlMenu()
+    # option 2
+    elif (b == BUTTON_3):
+        equipment.heaterPower(OFF)
+        heaterControlMenu()
 
-        # option 3
-        elif (b == BUTTON_2):
-            if (gv.heatEnable == ON):
-                equipment.heaterEnable(OFF)
-            else:
-                equipment.heaterEnable(ON)
+    # option 3
+    elif (b == BUTTON_2):
+        if (gv.heatEnable == ON):
+            equipment.heaterEnable(OFF)
+        else:
+            equipment.heaterEnable(ON)
 
-            heaterControlMenu()
+        heaterControlMenu()
 
-        # Back Button
-        elif (b == BUTTON_1):
-            exit = True
+    # Back Button
+    elif (b == BUTTON_1):
+        setState(MANUAL)
 
     return
-    # end heater control loop
+    # end heater control menu
 
 
 
@@ -517,38 +547,28 @@ def valveControlMenu():
     return
 
 
-def valveControlLoop():
-    exit = False
-    valveControlMenu()
-
-    # handle button press
-    while(exit == False):
-        b = buttons.readButtons()
-
-        # option 4
-        if (b == BUTTON_4):
-            equipment.valveControl(c.VALVE_POOL_MODE)
-            lcd.messageTimer("Moving...", 5)
-            valveControlMenu()
+def valveControlButtons(b):
+    # option 4
+    if (b == BUTTON_4):
+        equipment.valveControl(c.VALVE_POOL_MODE)
+        showMessage("Moving...", 5)
 
-        # option 3
-        elif (b == BUTTON_3):
-            equipment.valveControl(c.VALVE_SPA_MODE)
-            lcd.messageTimer("Moving...", 5)
-            valveControlMenu()
+    # option 3
+    elif (b == BUTTON_3):
+        equipment.valveControl(c.VALVE_SPA_MODE)
+        showMessage("Moving...", 5)
 
-        # option 2
-        elif (b == BUTTON_2):
-            equipment.valveControl(c.VALVE_DRAIN_MODE)
-            lcd.messageTimer("Moving...", 5)
-            valveControlMenu()
+    # option 2
+    elif (b == BUTTON_2):
+        equipment.valveControl(c.VALVE_DRAIN_MODE)
+        showMessage("Moving...", 5)
 
-        # Back Button 1
-        if (b == BUTTON_1):
-            exit = True
+    # Back Button 1
+    elif (b == BUTTON_1):
+        setState(MANUAL)
 
     return
-    # end manual valve control loop
+    # end manual valve control menu
 
 
 
@@ -567,71 +587,73 @@ def devToolsMenu():
     return
 
 
-def devToolsLoop():
-    exit = False
-    devToolsMenu()
+def devToolsButtons(b):
+    # back button
+    if (b == BUTTON_1):
+        setState(STATUS)
 
-    # handle button press
-    while(exit == False):
-        b = buttons.readButtons()
+    # option 1
+    elif (b == BUTTON_2):
+        setState(MANUAL)
 
-        # back button
-        if (b == BUTTON_1):
-            exit = True
+    # option 2
+    elif (b == BUTTON_3):
+        confirm("Exit ?", exitProgram)
 
-        # option 1
-        elif (b == BUTTON_2):
-            manualControlLoop()
-            exit = true
+    # option 3
+    elif (b == BUTTON_4):
+        confirm("Power Off ?", power.shutdown)
 
-        # option 2
-        elif (b == BUTTON_3):
-            if(confirm("Exit ?")):
-                gv.loop = False
-                exit = True
+    return
+    # end dev menu
 
-        # option 3
-        elif (b == BUTTON_4):
-            if (confirm("Power Off ?")):
-                battery.setPowerOff()
-                exit = True
 
-    # end dev loop
+def exitProgram():
+    gv.loop = False
+    return
 
 
 # -----------------------------------------------------
 
 
-def confirm(message = ""):
+# ask before running action, returns to the calling menu on cancel.
+# an unanswered confirm times out like any other menu, which cancels it
+def confirm(message, action):
+    global confirmMessage, confirmAction, confirmReturn
+
+    confirmMessage = message
+    confirmAction = action
+    confirmReturn = state
+    setState(CONFIRM)
+    return
+
+
 
+def confirmMenu():
     lcd.clearScreen()
     lcd.setCursor(1,1)
-    lcd.printLine(message)
+    lcd.printLine(confirmMessage)
     lcd.setCursor(2,1)
     lcd.printLine("    Continue ?")
     lcd.setCursor(4,1)
     lcd.printLine("Cancel          OK")
+    return
 
-    timeout = 0
-    while (True):
-        b = buttons.readButtons()
 
-        if (b == BUTTON_1):
-            return False
 
-        elif (b == BUTTON_4):
-            return True
+def confirmButtons(b):
+    global confirmAction
 
-        # check for timeout at ~30 seconds
-        timeout += 1
-        if (timeout > 3000):
-            # timeout returns a cancel
-            return False
+    if (b == BUTTON_1):
+        setState(confirmReturn)
 
-        # wait 1/10th second, provides good button response
-        time.sleep(0.1)
-    # end while
-    return False
+    elif (b == BUTTON_4):
+        action = confirmAction
+        confirmAction = None
+        setState(STATUS)
+        if (action is not None):
+            action()
+    return
 
 
 
@@ -646,11 +668,46 @@ def modeToStr(mode):
         return "ERROR"
 
 
+
+# menu state -> draw function / button handler
+DRAW = {
+    STATUS:      statusDisplay,
+    SPA:         lambda: spaMenu(hours),
+    PUMP:        lambda: pumpMenu(hours),
+    UTIL:        utilMenu,
+    SPA_TEMP:    setSpaTempMenu,
+    MANUAL:      manualControlMenu,
+    PUMP_CTRL:   pumpControlMenu,
+    HEATER_CTRL: heaterControlMenu,
+    VALVE_CTRL:  valveControlMenu,
+    DEV_TOOLS:   devToolsMenu,
+    CONFIRM:     confirmMenu
+}
+
+HANDLERS = {
+    STATUS:      statusButtons,
+    SPA:         spaButtons,
+    PUMP:        pumpButtons,
+    UTIL:        utilButtons,
+    SPA_TEMP:    setSpaTempButtons,
+    MANUAL:      manualControlButtons,
+    PUMP_CTRL:   pumpControlButtons,
+    HEATER_CTRL: heaterControlButtons,
+    VALVE_CTRL:  valveControlButtons,
+    DEV_TOOLS:   devToolsButtons,
+    CONFIRM:     confirmButtons
+}
+
+
 # ----- main ------------------------------------------------
 
 if __name__ == '__main__':
     log.init()
     buttons.init()
     lcd.init()
-    mainLoopButtons()
+    setState(STATUS)
+    while (gv.loop):
+        mainLoopButtons()
+        statusDisplay()
+        time.sleep(0.25)
     lcd.clearScreen()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# owFilter.py
+# filters 1-wire temperature readings before they are used
+#
+# A pipeline is a list of generator stages. Each stage is
+# sent a (time, temp) sample and yields the sample to pass
+# on, or REJECT to drop it. Stages keep only a fixed amount
+# of state (the median window is a bounded deque), so a
+# pipeline uses constant memory per sensor.
+#
+# stages, in pipeline order, from a config.OW_FILTERS entry:
+#   'range'  (low, high)  drop readings outside the range and
+#                         the DS18B20 85 C power-on value
+#   'median' n            median of the last n readings
+#   'rate'   degs / sec   limit how fast the value may change
+#   'ema'    alpha        exponential moving average
+#
+# version 1.0  18Oct26
+#
+
+from collections import deque
+
+
+# module constants
+REJECT = None
+
+# DS18B20 power-on / reset scratchpad value, 85 C
+POWER_ON_TEMP = 185.0
+
+STAGE_ORDER = ['range', 'median', 'rate', 'ema']
+
+
+
+def rangeStage(low, high):
+    out = None
+    while (True):
+        t, temp = yield out
+        if (temp == POWER_ON_TEMP or temp < low or temp > high):
+            out = REJECT
+        else:
+            out = (t, temp)
+
+
+
+def medianStage(n):
+    window = deque(maxlen=n)
+    out = None
+    while (True):
+        t, temp = yield out
+        window.append(temp)
+        ordered = sorted(window)
+        mid = len(ordered) // 2
+        if (len(ordered) % 2):
+            out = (t, ordered[mid])
+        else:
+            out = (t, (ordered[mid - 1] + ordered[mid]) / 2.0)
+
+
+
+# moves at most maxRate degs per sec toward the reading
+def rateStage(maxRate):
+    last = None
+    out = None
+    while (True):
+        t, temp = yield out
+        if (last is not None):
+            step = maxRate * max(t - last[0], 0.0)
+            temp = min(max(temp, last[1] - step), last[1] + step)
+        last = (t, temp)
+        out = last
+
+
+
+def emaStage(alpha):
+    value = None
+    out = None
+    while (True):
+        t, temp = yield out
+        if (value is None):
+            value = temp
+        else:
+            value = value + alpha * (temp - value)
+        out = (t, value)
+
+
+
+STAGES = {'range':  lambda arg: rangeStage(*arg),
+          'median': medianStage,
+          'rate':   rateStage,
+          'ema':    emaStage}
+
+
+
+# builds a pipeline from a settings dict, missing keys are skipped
+def makePipeline(settings):
+    pipeline = []
+    for name in STAGE_ORDER:
+        if (name in settings):
+            stage = STAGES[name](settings[name])
+            next(stage)
+            pipeline.append((name, stage))
+    return pipeline
+
+
+
+# runs a sample through the pipeline. returns the filtered temp,
+# or REJECT and the name of the stage that dropped it
+def run(pipeline, t, temp):
+    sample = (t, temp)
+    for name, stage in pipeline:
+        sample = stage.send(sample)
+        if (sample is REJECT):
+            return REJECT, name
+    return sample[1], None
+
+
+
+# ----- main ------------------------------------------------
+if __name__ == '__main__':
+
+    p = makePipeline({'range': (32.0, 115.0), 'median': 3, 'rate': 1.0, 'ema': 0.5})
+    for i, temp in enumerate([98.0, 98.2, 185.0, 98.4, 140.0, 98.6, 98.5]):
+        print(temp, run(p, i * 5.0, temp))
+    print("done")
@@ -0,0 +1,412 @@
+#!/usr/bin/python
+#
+# owSim.py
+# simulated 1-wire bus for testing without DS18B20 hardware
+#
+# Builds a fake w1 sysfs tree in a temp directory: one
+# 28-<id> directory per sensor with w1_slave, temperature
+# and resolution files, plus w1_bus_master1/therm_bulk_read.
+# An updater thread rewrites the files from each sensor's
+# temperature model (a function of secs since start that
+# returns deg C), rounded to the sensor's resolution.
+# w1thermsensor and owTempThread are pointed at the tree.
+#
+# faults, set with setFault() until cleared:
+#   CRC      w1_slave reports a bad crc
+#   RESET    the 85 C power-on value
+#   MISSING  the device directory is removed
+#   SLOW     reads block for 'delay' secs (files become
+#            fifos that a thread answers late)
+# setRates() injects CRC / RESET faults at random instead.
+#
+# enable with config.OW_SIM, or run this file for a
+# sampling benchmark
+#
+# version 1.0  18Oct26
+#
+# version 1.1  18Oct26  the w1thermsensor kernel module
+# override is only set when config.OW_SIM is, the benchmark
+# logs to the console and times poll()
+#
+# version 1.2  18Oct26  clearing a slow fault writes the device
+# files at once, the benchmark's stuck read ends within its phase
+#
+
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import config as c
+import log
+
+# w1thermsensor must not try to load the w1 kernel modules, so
+# this is imported before it wherever it is used
+if (c.OW_SIM):
+    os.environ.setdefault("W1THERMSENSOR_NO_KERNEL_MODULE", "1")
+
+
+# module constants
+CRC     = "crc"
+RESET   = "reset"
+MISSING = "missing"
+SLOW    = "slow"
+
+RESET_TEMP = 85.0
+TICK       = 0.1
+FAMILY     = "28"
+
+# scratchpad config byte for 9..12 bits
+CONFIG_BYTES = {9: 0x1f, 10: 0x3f, 11: 0x5f, 12: 0x7f}
+
+
+# module globals
+baseDir = None
+sensors = {}
+lock = threading.Lock()
+running = False
+updater = None
+startTime = 0.0
+
+
+
+# --- temperature models, deg C --------------------------
+
+def constant(tempC, noise=0.0):
+    return lambda t: tempC + random.gauss(0.0, noise) if noise else tempC
+
+
+def sine(mean, amplitude, period):
+    return lambda t: mean + amplitude * math.sin(2.0 * math.pi * t / period)
+
+
+def ramp(start, rate, limit=None):
+    def model(t):
+        temp = start + rate * t
+        return temp if limit is None else min(temp, limit)
+    return model
+
+
+
+# --- setup ----------------------------------------------
+
+# builds the tree and points w1thermsensor / owTempThread at it
+def start(ids=(), dirName=None):
+    global baseDir, running, updater, startTime
+
+    baseDir = dirName or tempfile.mkdtemp(prefix="w1sim-")
+    os.makedirs(os.path.join(baseDir, "w1_bus_master1"), exist_ok=True)
+    writeFile(os.path.join(baseDir, "w1_bus_master1", "therm_bulk_read"), "0\n")
+
+    for sensorId in ids:
+        addSensor(sensorId)
+
+    c.W1_DEVICES_DIR = baseDir + "/"
+    try:
+        from w1thermsensor import W1ThermSensor
+        W1ThermSensor.BASE_DIRECTORY = type(W1ThermSensor.BASE_DIRECTORY)(baseDir)
+    except ImportError:
+        log.log(log.WARNING, "w1thermsensor not installed, only sysfs reads are simulated")
+
+    startTime = time.monotonic()
+    running = True
+    update()
+    updater = threading.Thread(target=updateLoop, name="owSim", daemon=True)
+    updater.start()
+
+    log.log(log.ALWAYS, "simulated 1-wire bus at " + baseDir)
+    return baseDir
+
+
+
+def stop():
+    global running
+
+    running = False
+    with lock:
+        for sensorId in sensors:
+            sensors[sensorId]['fault'] = None
+            unblock(sensorId)
+    if (updater is not None):
+        updater.join(1.0)
+    if (baseDir is not None):
+        shutil.rmtree(baseDir, ignore_errors=True)
+    sensors.clear()
+    return
+
+
+
+def addSensor(sensorId, model=None):
+    with lock:
+        sensors[sensorId] = {'model':  model or constant(25.0),
+                             'fault':  None,
+                             'delay':  0.0,
+                             'crc':    0.0,
+                             'reset':  0.0,
+                             'fifos':  []}
+        os.makedirs(devicePath(sensorId), exist_ok=True)
+        writeFile(os.path.join(devicePath(sensorId), "resolution"), "12\n")
+        writeFile(os.path.join(devicePath(sensorId), "eeprom_cmd"), "")
+    return
+
+
+
+def setModel(sensorId, model):
+    with lock:
+        sensors[sensorId]['model'] = model
+    return
+
+
+
+def setRates(sensorId, crc=0.0, reset=0.0):
+    with lock:
+        sensors[sensorId]['crc'] = crc
+        sensors[sensorId]['reset'] = reset
+    return
+
+
+
+# fault is one of CRC, RESET, MISSING, SLOW or None to clear
+def setFault(sensorId, fault, delay=5.0):
+    with lock:
+        s = sensors[sensorId]
+        if (s['fault'] == SLOW and fault != SLOW):
+            s['fault'] = None
+            unblock(sensorId)
+            writeDevice(sensorId)
+        if (s['fault'] == MISSING and fault != MISSING):
+            os.makedirs(devicePath(sensorId), exist_ok=True)
+            writeFile(os.path.join(devicePath(sensorId), "resolution"), "12\n")
+
+        s['fault'] = fault
+        s['delay'] = delay
+
+        if (fault == MISSING):
+            shutil.rmtree(devicePath(sensorId), ignore_errors=True)
+        elif (fault == SLOW):
+            startSlow(sensorId)
+    return
+
+
+
+# --- files ----------------------------------------------
+
+def devicePath(sensorId):
+    return os.path.join(baseDir, FAMILY + "-" + sensorId)
+
+
+
+def writeFile(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return
+
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if (mix):
+                crc ^= 0x8c
+            byte >>= 1
+    return crc
+
+
+
+def resolution(sensorId):
+    try:
+        with open(os.path.join(devicePath(sensorId), "resolution"), 'r') as f:
+            bits = int(f.read().strip())
+        return bits if bits in CONFIG_BYTES else 12
+    except (OSError, ValueError):
+        return 12
+
+
+
+# w1_slave and temperature contents for one reading
+def deviceText(sensorId, tempC, badCrc):
+    bits = resolution(sensorId)
+    step = 0.5 / 2 ** (bits - 9)
+    tempC = round(tempC / step) * step
+
+    raw = int(round(tempC * 16)) & 0xffff
+    pad = [raw & 0xff, raw >> 8, 0x4b, 0x46, CONFIG_BYTES[bits], 0xff, 0x0c, 0x10]
+    crc = crc8(pad)
+    hexPad = " ".join("%02x" % b for b in pad)
+
+    if (badCrc):
+        status = "crc=%02x NO" % ((crc + 1) & 0xff)
+    else:
+        status = "crc=%02x YES" % crc
+
+    # the kernel fails a temperature read on a bad crc, an
+    # empty file does the same to the reader
+    milliC = int(round(tempC * 1000))
+    w1Slave = "%s %02x : %s\n%s %02x t=%d\n" % (hexPad, crc, status, hexPad, crc, milliC)
+    return w1Slave, "" if badCrc else "%d\n" % milliC
+
+
+
+def reading(sensorId):
+    s = sensors[sensorId]
+    tempC = s['model'](time.monotonic() - startTime)
+    badCrc = s['fault'] == CRC or random.random() < s['crc']
+    if (s['fault'] == RESET or random.random() < s['reset']):
+        tempC = RESET_TEMP
+    return deviceText(sensorId, tempC, badCrc)
+
+
+
+# --- updater --------------------------------------------
+
+def update():
+    with lock:
+        for sensorId, s in sensors.items():
+            if (s['fault'] in (MISSING, SLOW)):
+                continue
+            writeDevice(sensorId)
+    return
+
+
+
+def writeDevice(sensorId):
+    w1Slave, temperature = reading(sensorId)
+    try:
+        writeFile(os.path.join(devicePath(sensorId), "w1_slave"), w1Slave)
+        writeFile(os.path.join(devicePath(sensorId), "temperature"), temperature)
+    except OSError:
+        pass
+    return
+
+
+
+def updateLoop():
+    while (running):
+        update()
+        time.sleep(TICK)
+    return
+
+
+
+# --- slow reads -----------------------------------------
+
+# the device files become fifos, each open is answered after 'delay'
+def startSlow(sensorId):
+    for name in ("w1_slave", "temperature"):
+        path = os.path.join(devicePath(sensorId), name)
+        if (os.path.exists(path)):
+            os.remove(path)
+        os.mkfifo(path)
+        sensors[sensorId]['fifos'].append(path)
+        threading.Thread(target=serveSlow, args=(sensorId, path, name),
+                         name="owSim-slow", daemon=True).start()
+    return
+
+
+
+def serveSlow(sensorId, path, name):
+    s = sensors[sensorId]
+    while (running and s['fault'] == SLOW):
+        try:
+            fd = os.open(path, os.O_WRONLY)
+        except OSError:
+            return
+        try:
+            time.sleep(s['delay'])
+            if (s['fault'] == SLOW):
+                w1Slave, temperature = reading(sensorId)
+                os.write(fd, (w1Slave if name == "w1_slave" else temperature).encode())
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    return
+
+
+
+# wake any fifo writer waiting for a reader so it sees the fault cleared
+def unblock(sensorId):
+    for path in sensors[sensorId]['fifos']:
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            os.close(fd)
+            os.remove(path)
+        except OSError:
+            pass
+    sensors[sensorId]['fifos'] = []
+    return
+
+
+
+# ----- main ------------------------------------------------
+# sampling benchmark: reads every sensor for a few secs, bulk and
+# one at a time, then with one sensor stuck
+
+if __name__ == '__main__':
+
+    # set before owSim and w1thermsensor are imported
+    c.OW_SIM = True
+    log.initConsole(log.WARNING)
+
+    # owTempThread starts the owSim module, not this __main__ copy
+    import owSim as sim
+    import globalVars as gv
+    import owTempThread
+
+    secs = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+
+    # models are set before the first read so the filters start settled
+    owTempThread.loadRoles()
+    ids = owTempThread.roleIds
+    sim.start(ids)
+    sim.setModel(ids[c.SPA_TEMP], sim.sine(38.0, 1.0, 600.0))
+    sim.setModel(ids[c.CONTROLLER_TEMP], sim.constant(30.0))
+    sim.setModel(ids[c.AIR_TEMP], sim.constant(5.0, noise=0.1))
+    sim.setRates(ids[c.AIR_TEMP], crc=0.1, reset=0.05)
+    sim.update()
+    owTempThread.init()
+
+    # injected faults are counted, not allowed to disable a sensor
+    c.ALLOWED_ERRORS = 1000000
+
+    def goodReads():
+        return sum(getattr(gv, s['reading']).count for s in owTempThread.SENSORS)
+
+    # every sample period is made 0, so this is the rate poll() can
+    # read at and not the configured periods. the sim files answer
+    # at once, there is no conversion delay
+    owTempThread.samplePeriod = lambda sensor: 0.0
+
+    def bench(label):
+        start = goodReads()
+        end = time.monotonic() + secs
+        while (time.monotonic() < end):
+            owTempThread.poll()
+        print("%-18s %7.1f good reads/sec   spa %.1f  air %.1f  air rejects %d  air errors %d  controller errors %d" %
+              ((label, (goodReads() - start) / secs, gv.spaTemp, gv.airTemp,
+                gv.owAirRejects, gv.owAirErrors, gv.owCntrlErrors)))
+
+    bench("bulk" if owTempThread.bulk else "sysfs")
+
+    # longer than a read's deadline, then the stuck read is let finish
+    # so it doesn't carry into the next phase
+    sim.setFault(ids[c.CONTROLLER_TEMP], sim.SLOW, delay=min(5.0, secs))
+    bench("controller stuck")
+    sim.setFault(ids[c.CONTROLLER_TEMP], None)
+    for worker in list(owTempThread.inFlight.values()):
+        worker.join()
+
+    owTempThread.bulk = False
+    bench("one at a time")
+
+    sim.stop()
+    print("done")
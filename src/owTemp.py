@@ -6,6 +6,16 @@
 #
 #    version 1.4   11-02-18
 #
+#    version 1.5   18Oct26  thermostat and freeze check only
+#    act on readings younger than SPA/AIR_TEMP_MAX_AGE, a
+#    stale spa reading turns the heater off
+#
+#    version 1.6   18Oct26  optional PID / time proportioning
+#    heater control (config.THERMOSTAT_MODE, pid.py)
+#
+#    version 1.7   18Oct26  imports owSim first so config.OW_SIM
+#    runs without the w1 kernel modules
+#
 #
 #
 
@@ -14,10 +24,12 @@
 import time
 import config as c
 import globalVars as gv
+import owSim    # before w1thermsensor, see owSim.py
 from w1thermsensor import W1ThermSensor as owtemp
 import log
 import equipment
 import owTempThread
+import pid
 from threading import Thread
 
 
@@ -72,9 +84,42 @@ def getControllerTemp():
     return gv.controllerTemp
 
 
+def getReading(sensor):
+    return getattr(gv, owTempThread.SENSORS[sensor]['reading'])
+
+
+
+# secs since sensor was last read, None if never
+def readingAge(sensor):
+    reading = getReading(sensor)
+    if (reading.time == 0.0):
+        return None
+    return time.monotonic() - reading.time
+
+
+
+# the sensor's value if it is no older than maxAge secs, else None
+def freshTemp(sensor, maxAge):
+    age = readingAge(sensor)
+    if (age is None or age > maxAge):
+        return None
+    return getReading(sensor).value
+
+
+
+def ageStr(sensor):
+    age = readingAge(sensor)
+    if (age is None):
+        return "--"
+    return str(int(age))
+
+
+
 def getDeviceID(i):
-    if (i >= 0 and i < 3):
+    if (i in gv.sensors):
         return str(gv.sensors[i].id)
+    elif (i >= 0 and i < 3):
+        return "none"
     else:
         return ("invalid getDeviceID() index")
 
@@ -89,11 +134,16 @@ def checkForFreeze():
     if (gv.systemMode == c.FREEZE):
         return
 
+    airTemp = freshTemp(c.AIR_TEMP, c.AIR_TEMP_MAX_AGE)
+    if (airTemp is None):
+        log.log(log.WARNING, "no recent air temp, freeze check skipped")
+        return
+
     # if its freezing, turn on pump for an hour then check again
     # should I use both air and water temp??
     #if (getAirTemp() < c.FREEZE_TEMP and getSpaTemp() < 38):
-    if (getAirTemp() < c.FREEZE_TEMP):
-        log.log(log.CRITICAL, "Freeze detected at air: %f  spa: %f" % (getAirTemp(), getSpaTemp()))
+    if (airTemp < c.FREEZE_TEMP):
+        log.log(log.CRITICAL, "Freeze detected at air: %f  spa: %f" % (airTemp, getSpaTemp()))
         equipment.pumpOn(1)
         gv.systemMode = c.FREEZE
     return
@@ -104,7 +154,7 @@ def thermostat():
     global lastHeaterOffTime
 
     secs = int(time.mktime(time.localtime()))
-    temp = getSpaTemp()
+    temp = freshTemp(c.SPA_TEMP, c.SPA_TEMP_MAX_AGE)
 
     # is spa on?
     if (gv.systemMode == c.SPA_ON):
@@ -114,6 +164,14 @@ def thermostat():
             log.log(log.ERROR, "Spa Temp Sensor not detected")
             return ERROR
 
+        # don't heat on an old reading, heat resumes once it is fresh
+        if (temp is None):
+            if (gv.heatEnable == ON):
+                equipment.heaterEnable(OFF)
+                lastHeaterOffTime = secs
+            log.log(log.ERROR, "Spa temp older than %i secs, heater off" % c.SPA_TEMP_MAX_AGE)
+            return ERROR
+
         # check for over temp
         if (temp > c.HEATER_MAX_TEMP):
             equipment.heaterEnable(OFF)
@@ -121,6 +179,9 @@ def thermostat():
             log.log(log.ERROR, "ERROR: Spa over max temp: " + str(temp))
             return ERROR
 
+        elif (c.THERMOSTAT_MODE == "pid"):
+            return pidThermostat(temp, secs)
+
         else:
             log.log(log.INFO, "Spa Temp  = " + str(temp))
 
@@ -140,12 +201,32 @@ def thermostat():
                     equipment.heaterEnable(ON)
                 return NOERROR
     else:
-        return NOERR
+        return NOERROR
+
+
+
+# heater on for the pid output's share of each window
+def pidThermostat(temp, secs):
+    global lastHeaterOffTime
+
+    want = pid.demand(temp, gv.spaSetPoint, gv.heatEnable == ON, time.monotonic())
+    log.log(log.INFO, "Spa Temp  = %s, pid output %.2f" % (str(temp), pid.output))
+
+    if (want and gv.heatEnable != ON):
+        log.log(log.ALWAYS, "pid: turning on heat at " + str(temp))
+        equipment.heaterEnable(ON)
+
+    elif (not want and gv.heatEnable == ON):
+        log.log(log.ALWAYS, "pid: turning off heat at " + str(temp))
+        equipment.heaterEnable(OFF)
+        lastHeaterOffTime = secs
+
+    return NOERROR
 
 
 
 def resetErrors():
-    gv.owAirErrors   = 0
+    gv.owSpaErrors   = 0
     gv.owCntrlErrors = 0
     gv.owAirErrors   = 0
     gv.spaSensorEnabled  = True
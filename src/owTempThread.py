@@ -12,16 +12,78 @@
 #  version 1.1 - 21Jul20: read spa temp every 20
 #  seconds rather than every 30 seconds
 #
+#  version 1.2 - 18Oct26: bulk conversion. When the bus
+#  master has therm_bulk_read, one trigger starts a
+#  conversion on every sensor at once and each value is
+#  then read from sysfs, so all sensors refresh in one
+#  conversion window. Without it, the sensors are read
+#  one at a time as before. The per sensor read / error
+#  code is driven by the SENSORS table.
+#
+#  version 1.3 - 18Oct26: each sensor has its own sample
+#  period that follows what the controller is doing (see
+#  samplePeriod), instead of the fixed 60 count cycle.
+#
+#  version 1.4 - 18Oct26: init sets each sensor's
+#  resolution from config.OW_RESOLUTION (9-12 bits), saved
+#  to the sensor eeprom only when it differs. 9 bits
+#  converts in 94 ms instead of 750 ms at 12 bits.
+#
+#  version 1.5 - 18Oct26: readings pass through a filter
+#  pipeline (owFilter, config.OW_FILTERS) before they are
+#  stored. Rejected readings are counted in gv.ow*Rejects,
+#  apart from the bus error counters.
+#
+#  version 1.6 - 18Oct26: sensor roles (spa, controller,
+#  air) come from a saved id table (config.OW_ROLES_FILE,
+#  defaults from config), which the web page or the
+#  command line can change. The bus is rescanned every
+#  OW_RESCAN_PERIOD secs, so new or reseated sensors are
+#  picked up and disabled ones re-enabled without a
+#  restart. Unknown ids are only logged.
+#
+#  version 1.7 - 18Oct26: every bus access runs in its own
+#  daemon worker with a deadline (conversion time plus
+#  OW_READ_TIMEOUT). A read that misses it counts as an
+#  error, and while it is still stuck that sensor's reads
+#  keep failing fast, so a hung sensor can't stall the
+#  other sensors or keep the thread from exiting.
+#
+#  version 1.8 - 18Oct26: each read also updates the
+#  sensor's gv Reading (value, time, count, quality) so
+#  consumers can tell how old a value is.
+#
+#  version 1.9 - 18Oct26: config.OW_SIM runs on the fake
+#  w1 sysfs tree from owSim.py, one sensor per role id.
+#
+#  version 1.10 - 18Oct26: a sensor's due time is its last
+#  read plus its period as of now, so a switch to spa mode
+#  reads the spa at once. periods stay under *_MAX_AGE.
+#
+#  version 1.11 - 18Oct26: a change to the roles file (the
+#  assign command) is picked up on the next poll step.
+#
+#  version 1.12 - 18Oct26: setting a sensor's resolution when
+#  it is attached has a deadline too.
+#
+#  usage: owTempThread.py [list | assign <role> <id>]
 #
 #
 
 
 
+import glob
+import os
+import sys
+import threading
 import time
 import config as c
 import globalVars as gv
+import owSim    # before w1thermsensor, see owSim.py
 from w1thermsensor import W1ThermSensor as owtemp
 import log
+import owFilter
+import util
 
 
 # module constants
@@ -33,9 +95,60 @@ NOERROR = c.NOERROR
 
 TEMP_ERROR = -99
 
+# DS18B20 conversion secs at 9 bits, doubles for each extra bit
+CONVERSION_TIME = 0.094
+MIN_RESOLUTION  = 9
+MAX_RESOLUTION  = 12
+
+# extra secs allowed on top of the conversion time
+BULK_MARGIN = 0.25
+BULK_BUSY   = "-1"
+
+# inFlight keys for bus wide calls
+BUS  = "bus"
+SCAN = "scan"
+
+# secs a sample period is kept under the sensor's max reading age,
+# room for the poll step and the read itself
+AGE_MARGIN = 5.0
+
+# gv names for each sensor, indexed by c.SPA_TEMP, c.CONTROLLER_TEMP, c.AIR_TEMP
+SENSORS = [
+    {'name': "Spa",        'role': "spa",        'value': 'spaTemp',        'enabled': 'spaSensorEnabled',
+     'errors': 'owSpaErrors',   'rejects': 'owSpaRejects',   'reading': 'spaReading',
+     'maxAge': c.SPA_TEMP_MAX_AGE},
+    {'name': "Controller", 'role': "controller", 'value': 'controllerTemp', 'enabled': 'cntrlSensorEnabled',
+     'errors': 'owCntrlErrors', 'rejects': 'owCntrlRejects', 'reading': 'controllerReading',
+     'maxAge': c.CONTROLLER_TEMP_MAX_AGE},
+    {'name': "Air",        'role': "air",        'value': 'airTemp',        'enabled': 'airSensorEnabled',
+     'errors': 'owAirErrors',   'rejects': 'owAirRejects',   'reading': 'airReading',
+     'maxAge': c.AIR_TEMP_MAX_AGE},
+]
+
+DEFAULT_IDS = [c.SPA_TEMP_SENSOR_ID, c.CONTROLLER_TEMP_SENSOR_ID, c.AIR_TEMP_SENSOR_ID]
+
 
 #module globals
 loop = True
+bulk = False
+bulkTimeout = CONVERSION_TIME * 8 + BULK_MARGIN
+paths = {}
+filters = {}
+resolutions = {}
+
+# sensor id for each role, ids last seen on the bus, and ids
+# already reported as unknown
+roleIds = list(DEFAULT_IDS)
+present = []
+unknown = set()
+nextScan = 0.0
+rolesTime = None     # mtime of the roles file when last loaded or saved
+
+# sensor (or BUS, SCAN) -> worker thread of a call that has not returned
+inFlight = {}
+
+# monotonic time each sensor was last read, a sensor not in it is due
+lastRead = {}
 
 
 def run():
@@ -45,31 +158,12 @@ def run():
     if (init() == NOERROR):
 
         # read all temps on start
-        getSpaTemp()
-        time.sleep(1)
-
-        getAirTemp()
-        time.sleep(1)
-
-        getControllerTemp()
-        time.sleep(1)
+        readAll()
 
-        count = 0
-        # loop once a second, read temp every other loop
+        # poll() reads whichever sensors are due and says how long
+        # to wait, at most a second
         while (loop == True):
-            count += 1
-            if (count == 10 or count == 30 or count == 50):
-                getSpaTemp()
-
-            elif (count == 20):
-                getAirTemp()
-
-            elif (count == 40):
-                getControllerTemp()
-                count = 0
-
-            else:
-                time.sleep(1)
+            time.sleep(poll())
 
             # if main loop ends, then end this thread
             if (gv.loop == False):
@@ -80,6 +174,105 @@ def run():
         return
 
 
+def readAll():
+    # one conversion for every sensor, then read each result
+    if (bulk and timedBulk()):
+        for sensor in range(len(SENSORS)):
+            getTemp(sensor, readSysfsF)
+            markRead(sensor)
+        return
+
+    getSpaTemp()
+    markRead(c.SPA_TEMP)
+    time.sleep(1)
+
+    getAirTemp()
+    markRead(c.AIR_TEMP)
+    time.sleep(1)
+
+    getControllerTemp()
+    markRead(c.CONTROLLER_TEMP)
+    time.sleep(1)
+    return
+
+
+# one step of the sampling cycle, returns secs to wait before the next step.
+# used by run() and by the asyncio runtime
+def poll():
+    global nextScan
+
+    now = time.monotonic()
+    if (now >= nextScan or rolesChanged()):
+        nextScan = now + c.OW_RESCAN_PERIOD
+        scan()
+
+    # periods are taken now, so a mode change applies at once
+    dueAt = {}
+    for sensor in range(len(SENSORS)):
+        dueAt[sensor] = dueTime(sensor)
+    due = [s for s in dueAt if dueAt[s] <= now]
+
+    if (len(due) == 0):
+        return min(min(dueAt.values()) - now, 1.0)
+
+    # one conversion covers every due sensor
+    if (bulk and timedBulk()):
+        for sensor in due:
+            getTemp(sensor, readSysfsF)
+            markRead(sensor)
+        return 0.0
+
+    # else one sensor per step, most overdue first. a
+    # conversion takes about a second already
+    sensor = min(due, key=lambda s: dueAt[s])
+    getTemp(sensor)
+    markRead(sensor)
+    return 0.0
+
+
+
+def markRead(sensor):
+    lastRead[sensor] = time.monotonic()
+    return
+
+
+
+# monotonic time a sensor is due, from its period as of now
+def dueTime(sensor):
+    if (sensor not in lastRead):
+        return 0.0
+    return lastRead[sensor] + samplePeriod(sensor)
+
+
+
+# secs between reads of a sensor. the spa is read fast when the
+# thermostat is working near the setpoint and slowly when the system
+# is off, the air faster as it nears freezing, the controller rarely.
+# never so slow that the reading goes stale (SENSORS maxAge)
+def samplePeriod(sensor):
+    return min(contextPeriod(sensor), SENSORS[sensor]['maxAge'] - AGE_MARGIN)
+
+
+
+def contextPeriod(sensor):
+    if (sensor == c.SPA_TEMP):
+        if (gv.systemMode == c.SPA_ON):
+            if (abs(gv.spaSetPoint - gv.spaTemp) <= c.OW_SPA_NEAR_TEMP):
+                return c.OW_SPA_FAST_PERIOD
+            return c.OW_SPA_PERIOD
+        if (gv.systemMode == c.SYS_OFF):
+            return c.OW_SPA_IDLE_PERIOD
+        return c.OW_SPA_PERIOD
+
+    elif (sensor == c.AIR_TEMP):
+        # scales from fast at FREEZE_TEMP to slow OW_AIR_BAND above it
+        band = (gv.airTemp - c.FREEZE_TEMP) / c.OW_AIR_BAND
+        band = min(max(band, 0.0), 1.0)
+        return c.OW_AIR_FAST_PERIOD + band * (c.OW_AIR_PERIOD - c.OW_AIR_FAST_PERIOD)
+
+    return c.OW_CNTRL_PERIOD
+
+
 def stop():
     global loop
     loop = False
@@ -87,119 +280,296 @@ def stop():
 
 
 def init():
+    global bulk
+
+    loadRoles()
+    if (c.OW_SIM and owSim.baseDir is None):
+        owSim.start(roleIds)
+
+    paths.clear()
+    lastRead.clear()
+    resolutions.clear()
+    gv.sensors.clear()
+
+    # sensors that are missing now are picked up by a later scan
+    scan()
+    if (len(gv.sensors) < c.NUM_SENSORS):
+        log.log(log.WARNING, "warning: Not All Temp Sensors Responding")
+
+    bulk = c.OW_BULK_READ and len(bulkMasters()) > 0
+    log.log(log.ALWAYS, "1-wire bulk conversion " + ("on" if bulk else "off"))
+
+    log.log(log.ALWAYS, "Sensor Init Complete")
+    gv.owInitComplete = True
+    return NOERROR
+
+
+
+# --- sensor discovery -----------------------------------
+
+def loadRoles():
+    global roleIds, rolesTime
+
+    rolesTime = rolesMtime()
+    saved = util.readJson(c.OW_ROLES_FILE, {})
+    if (not isinstance(saved, dict)):
+        saved = {}
+
+    ids = []
+    for i in range(len(SENSORS)):
+        ids.append(str(saved.get(SENSORS[i]['role'], DEFAULT_IDS[i])))
+    roleIds = ids
+    return
+
+
+
+def saveRoles():
+    global rolesTime
+
+    data = {}
+    for i in range(len(SENSORS)):
+        data[SENSORS[i]['role']] = roleIds[i]
+    result = util.atomicWriteJson(c.OW_ROLES_FILE, data)
+    rolesTime = rolesMtime()
+    return result
+
+
+
+def rolesMtime():
     try:
-        s = owtemp.get_available_sensors()
-    except:
-        log.log(log.ERROR, "1-wire get sensors Not Responding, check 1-wire bus")
+        return os.path.getmtime(c.OW_ROLES_FILE)
+    except OSError:
+        return None
+
+
+
+# True if the roles file was changed by someone else (command line)
+def rolesChanged():
+    return rolesMtime() != rolesTime
+
+
+
+# give a role a new sensor id and save it. the sensor is attached
+# by the sampling thread on its next scan, which is made due now
+def setRole(role, sensorId):
+    global roleIds, nextScan
+
+    roles = [s['role'] for s in SENSORS]
+    if (role not in roles):
+        log.log(log.ERROR, "unknown sensor role " + str(role))
         return ERROR
 
-    numSensors = len(s)
-    log.log(log.INFO, "Found " + str(numSensors) + " Sensors")
+    sensorId = str(sensorId).strip()
+    i = roles.index(role)
+    if (sensorId == "" or (sensorId in roleIds and roleIds.index(sensorId) != i)):
+        log.log(log.ERROR, "sensor id %s is empty or already in use" % sensorId)
+        return ERROR
 
-    if (numSensors < c.NUM_SENSORS):
-        log.log(log.WARNING, "warning: Not All Temp Sensors Responding")
+    ids = list(roleIds)
+    ids[i] = sensorId
+    roleIds = ids
+    nextScan = 0.0
+    log.log(log.ALWAYS, "%s sensor set to %s" % (SENSORS[i]['name'], sensorId))
+    return saveRoles()
 
-    # find correct sensor for each function
-    for i in range(0, numSensors):
-        log.log(log.INFO, "Found Sensor %s" % (s[i].id))
 
-        if (s[i].id == c.SPA_TEMP_SENSOR_ID):
-        	gv.sensors[0] = s[i]
-        	gv.spaSensorEnabled = True
 
-        elif (s[i].id == c.CONTROLLER_TEMP_SENSOR_ID):
-        	gv.sensors[1] = s[i]
-        	gv.cntrlSensorEnabled = True
+# match the sensors on the bus to their roles. attaches new or
+# replaced sensors and re-enables ones that were disabled
+def scan():
+    global present
 
-        elif (s[i].id == c.AIR_TEMP_SENSOR_ID):
-        	gv.sensors[2] = s[i]
-        	gv.airSensorEnabled = True
+    if (rolesChanged()):
+        log.log(log.ALWAYS, "sensor roles file changed, reloading")
+        loadRoles()
 
-        else:
-            log.log(log.ERROR, "No Match for temp sensor - Check Config File. ID = "  + str(s[i].id))
-            return ERROR
+    found, ok = timedCall(SCAN, c.OW_READ_TIMEOUT, owtemp.get_available_sensors)
+    if (not ok or found is None):
+        log.log(log.ERROR, "1-wire get sensors Not Responding, check 1-wire bus")
+        return ERROR
 
+    byId = {}
+    for sensor in found:
+        byId[str(sensor.id)] = sensor
+    present = sorted(byId)
 
-    for i in range(0, numSensors):
-        log.log(log.ALWAYS, "Sensor %d id = %s matched to %s" % (i, str(gv.sensors[i].id), c.TEMP_SENSOR_NAMES[i]))
+    for sensorId in byId:
+        if (sensorId not in roleIds and sensorId not in unknown):
+            unknown.add(sensorId)
+            log.log(log.WARNING, "No role for temp sensor %s, assign one to use it" % sensorId)
+
+    for i in range(len(SENSORS)):
+        s = SENSORS[i]
+        sensor = byId.get(roleIds[i])
+        current = gv.sensors.get(i)
+
+        if (sensor is None):
+            if (current is not None and getattr(gv, s['enabled'])):
+                log.log(log.WARNING, "%s sensor %s missing from the bus" % (s['name'], str(current.id)))
+            continue
+
+        if (current is None or str(current.id) != str(sensor.id)):
+            attach(i, sensor)
+
+        elif (getattr(gv, s['enabled']) == False):
+            setattr(gv, s['errors'], 0)
+            setattr(gv, s['enabled'], True)
+            lastRead.pop(i, None)
+            log.log(log.ALWAYS, "%s sensor re-enabled" % s['name'])
 
-    log.log(log.ALWAYS, "Sensor Init Complete")
-    gv.owInitComplete = True
     return NOERROR
 
 
 
+def attach(i, sensor):
+    global bulkTimeout
 
+    s = SENSORS[i]
+    gv.sensors[i] = sensor
+    paths.pop(i, None)
+    filters[i] = owFilter.makePipeline(c.OW_FILTERS[i])
 
-def getSpaTemp():
+    # the resolution read / eeprom save is a bus access like any read.
+    # if it fails, deadlines assume the slowest conversion
+    bits, ok = timedCall(i, conversionTime(MAX_RESOLUTION) + c.OW_READ_TIMEOUT,
+                         setResolution, i, c.OW_RESOLUTION[i])
+    resolutions[i] = bits if ok else MAX_RESOLUTION
 
-    if(gv.spaSensorEnabled == False):
-        return TEMP_ERROR
+    # a bulk conversion lasts as long as the finest sensor's
+    bulkTimeout = conversionTime(max(resolutions.values())) + BULK_MARGIN
 
-    temp  = readTempF(c.SPA_TEMP)
-    log.log(log.INFO, "spa temp = " + str(round(temp, 1)))
+    setattr(gv, s['errors'], 0)
+    setattr(gv, s['enabled'], True)
+    lastRead.pop(i, None)
+    log.log(log.ALWAYS, "Sensor %d id = %s matched to %s" % (i, str(sensor.id), c.TEMP_SENSOR_NAMES[i]))
+    return
 
-    # check for errors
-    if (temp == TEMP_ERROR):
-        gv.owSpaErrors += 1
 
-        # have we exceeded allowed number of errors?
-        if (gv.owSpaErrors > c.ALLOWED_ERRORS):
-            gv.spaSensorEnabled = False
-            log.log(log.ERROR, "Spa 1-wire Errors > limit")
-            return TEMP_ERROR
 
-    gv.spaTemp = temp
-    return temp
+def getSensorInfo():
+    info = []
+    for i in range(len(SENSORS)):
+        s = SENSORS[i]
+        info.append({'role':    s['role'],
+                     'id':      roleIds[i],
+                     'present': roleIds[i] in present,
+                     'enabled': getattr(gv, s['enabled']),
+                     'errors':  getattr(gv, s['errors']),
+                     'rejects': getattr(gv, s['rejects']),
+                     'temp':    getattr(gv, s['value']),
+                     'quality': c.READ_QUALITY_NAMES[getattr(gv, s['reading']).quality]})
+    return {'sensors': info, 'unassigned': [i for i in present if i not in roleIds]}
+
 
 
 
+
+def getSpaTemp():
+    return getTemp(c.SPA_TEMP)
+
+
 def getControllerTemp():
+    return getTemp(c.CONTROLLER_TEMP)
+
 
-    if(gv.cntrlSensorEnabled == False):
+def getAirTemp():
+    return getTemp(c.AIR_TEMP)
+
+
+
+# read one sensor with read(sensor), count errors and store the result
+def getTemp(sensor, read=None):
+    s = SENSORS[sensor]
+
+    if (getattr(gv, s['enabled']) == False):
         return TEMP_ERROR
 
-    temp = readTempF(c.CONTROLLER_TEMP)
-    log.log(log.INFO, "Controller temp = " + str(round(temp, 1)))
+    temp = timedRead(sensor, read or readTempF)
+    log.log(log.INFO, "%s temp = %s" % (s['name'], str(round(temp, 1))))
+
+    reading = getattr(gv, s['reading'])
 
-    # check for errors
+    # check for errors, the reading keeps its last good value
     if (temp == TEMP_ERROR):
-        gv.owCntrlErrors += 1
+        setattr(gv, s['reading'], reading._replace(quality=c.READ_ERROR))
+        errors = getattr(gv, s['errors']) + 1
+        setattr(gv, s['errors'], errors)
 
         # have we exceeded allowed number of errors?
-        if (gv.owCntrlErrors > c.ALLOWED_ERRORS):
-            gv.cntrlSensorEnabled = False
-            log.log(log.ERROR, "Controller 1-wire Errors > limit")
+        if (errors > c.ALLOWED_ERRORS):
+            setattr(gv, s['enabled'], False)
+            log.log(log.ERROR, "%s 1-wire Errors > limit" % s['name'])
+        return TEMP_ERROR
+
+    # a good read that the filters drop is not a bus error
+    if (sensor in filters):
+        temp, stage = owFilter.run(filters[sensor], time.monotonic(), temp)
+        if (temp is owFilter.REJECT):
+            setattr(gv, s['rejects'], getattr(gv, s['rejects']) + 1)
+            setattr(gv, s['reading'], reading._replace(quality=c.READ_REJECTED))
+            log.log(log.WARNING, "%s reading rejected by %s filter" % (s['name'], stage))
             return TEMP_ERROR
+        temp = round(temp, 1)
 
-    gv.controllerTemp = temp
+    setattr(gv, s['reading'], gv.Reading(temp, time.monotonic(), reading.count + 1, c.READ_GOOD))
+    setattr(gv, s['value'], temp)
     return temp
 
 
 
-def getAirTemp():
+# --- timed bus access -----------------------------------
 
-    if(gv.airSensorEnabled == False):
-        return TEMP_ERROR
+# runs func(*args) in a daemon worker and waits up to timeout secs.
+# returns (result, ok), ok is False if it timed out, if the last call
+# for this key is still stuck, or if func raised
+def timedCall(key, timeout, func, *args):
+    worker = inFlight.get(key)
+    if (worker is not None):
+        if (worker.is_alive()):
+            log.log(log.WARNING, "1-wire %s still stuck, skipping" % keyName(key))
+            return None, False
+        del inFlight[key]
 
-    temp = readTempF(c.AIR_TEMP)
-    log.log(log.INFO, "air temp = " + str(round(temp, 1)))
+    result = []
+    worker = threading.Thread(target=lambda: result.append(func(*args)),
+                              name="ow-" + keyName(key), daemon=True)
+    worker.start()
+    worker.join(timeout)
 
-    # check for errors
-    if (temp == TEMP_ERROR):
-        gv.owAirErrors += 1
+    if (worker.is_alive()):
+        inFlight[key] = worker
+        log.log(log.ERROR, "1-wire %s timed out after %.1f secs" % (keyName(key), timeout))
+        return None, False
+
+    if (len(result) == 0):
+        return None, False
+    return result[0], True
+
+
+
+def keyName(key):
+    if (key in (BUS, SCAN)):
+        return key
+    return SENSORS[key]['name']
 
-        # have we exceeded allowed number of errors?
-        if (gv.owAirErrors > c.ALLOWED_ERRORS):
-            gv.airSensorEnabled = False
-            log.log(log.ERROR, "Air 1-wire Errors > limit")
-            return TEMP_ERROR
 
-    gv.airTemp = temp
+
+def timedRead(sensor, read):
+    timeout = conversionTime(resolutions.get(sensor, MAX_RESOLUTION)) + c.OW_READ_TIMEOUT
+    temp, ok = timedCall(sensor, timeout, read, sensor)
+    if (not ok):
+        return TEMP_ERROR
     return temp
 
 
 
+def timedBulk():
+    done, ok = timedCall(BUS, bulkTimeout + c.OW_READ_TIMEOUT, bulkConvert)
+    return ok and done
+
+
+
+# reads with its own conversion (~750 ms)
 def readTempF(sensorID):
 
     try:
@@ -211,13 +581,158 @@ def readTempF(sensorID):
     return round(temp, 1)
 
 
+
+# --- resolution -----------------------------------------
+
+def conversionTime(bits):
+    return CONVERSION_TIME * 2 ** (bits - MIN_RESOLUTION)
+
+
+
+def getResolution(sensorID):
+    try:
+        with open(os.path.join(sensorPath(sensorID), "resolution"), 'r') as f:
+            return int(f.read().strip())
+    except (OSError, TypeError, ValueError):
+        pass
+
+    try:
+        return gv.sensors[sensorID].get_resolution()
+    except Exception:
+        return None
+
+
+
+# set and save a sensor's resolution if it is not already set, the
+# eeprom has limited writes. returns the resolution now in use
+def setResolution(sensorID, bits):
+    if (bits < MIN_RESOLUTION or bits > MAX_RESOLUTION):
+        log.log(log.ERROR, "bad resolution %s for %s" % (str(bits), SENSORS[sensorID]['name']))
+        bits = MAX_RESOLUTION
+
+    current = getResolution(sensorID)
+    if (current == bits):
+        return bits
+
+    try:
+        gv.sensors[sensorID].set_resolution(bits, persist=True)
+
+    except Exception:
+        # kernel sysfs: write the scratchpad then copy it to eeprom
+        try:
+            path = sensorPath(sensorID)
+            with open(os.path.join(path, "resolution"), 'w') as f:
+                f.write(str(bits))
+            with open(os.path.join(path, "eeprom_cmd"), 'w') as f:
+                f.write("save")
+        except (OSError, TypeError) as e:
+            log.log(log.ERROR, "unable to set %s resolution: %s" % (SENSORS[sensorID]['name'], str(e)))
+            return current or MAX_RESOLUTION
+
+    log.log(log.ALWAYS, "%s resolution %s -> %i bits" % (SENSORS[sensorID]['name'], str(current), bits))
+    return bits
+
+
+
+# --- bulk conversion ------------------------------------
+
+def bulkMasters():
+    return glob.glob(os.path.join(c.W1_DEVICES_DIR, "w1_bus_master*", "therm_bulk_read"))
+
+
+
+# start a conversion on every sensor of every bus and wait for it,
+# returns False if it could not be done
+def bulkConvert():
+    try:
+        masters = bulkMasters()
+        for m in masters:
+            with open(m, 'w') as f:
+                f.write("trigger\n")
+
+        deadline = time.monotonic() + bulkTimeout
+        for m in masters:
+            while (True):
+                with open(m, 'r') as f:
+                    if (f.read().strip() != BULK_BUSY):
+                        break
+                if (time.monotonic() > deadline):
+                    log.log(log.WARNING, "1-wire bulk conversion timed out")
+                    return False
+                time.sleep(0.05)
+
+    except OSError as e:
+        log.log(log.ERROR, "1-wire bulk conversion failed: " + str(e))
+        return False
+
+    return len(masters) > 0
+
+
+
+# sysfs directory of a sensor, e.g. /sys/bus/w1/devices/28-0316a13f61ff
+def sensorPath(sensorID):
+    if (sensorID not in paths):
+        found = glob.glob(os.path.join(c.W1_DEVICES_DIR, "*-" + str(gv.sensors[sensorID].id)))
+        if (len(found) == 0):
+            return None
+        paths[sensorID] = found[0]
+    return paths[sensorID]
+
+
+
+# reads the last converted value without starting a new conversion
+def readSysfsF(sensorID):
+    try:
+        path = sensorPath(sensorID)
+        if (path is None):
+            return TEMP_ERROR
+
+        # millidegrees C, older kernels only have w1_slave
+        tempFile = os.path.join(path, "temperature")
+        if (os.path.exists(tempFile)):
+            with open(tempFile, 'r') as f:
+                milliC = int(f.read().strip())
+        else:
+            with open(os.path.join(path, "w1_slave"), 'r') as f:
+                lines = f.read().splitlines()
+            if (len(lines) < 2 or not lines[0].strip().endswith("YES")):
+                return TEMP_ERROR
+            milliC = int(lines[1].split("t=")[1])
+
+    except (OSError, ValueError, IndexError, KeyError):
+        return TEMP_ERROR
+
+    return round(milliC / 1000.0 * 9.0 / 5.0 + 32.0, 1)
+
+
 #---------------------------------------------
 if  __name__ == '__main__':
 
     DEBUG = True
 
+    # list sensors, or assign one to a role and exit
+    if (len(sys.argv) > 1 and sys.argv[1] == "list"):
+        loadRoles()
+        scan()
+        info = getSensorInfo()
+        for sensor in info['sensors']:
+            print("%-10s %-14s present=%s" % (sensor['role'], sensor['id'], sensor['present']))
+        print("unassigned: " + ", ".join(info['unassigned']))
+        sys.exit(0)
+
+    if (len(sys.argv) > 1 and sys.argv[1] == "assign"):
+        if (len(sys.argv) != 4):
+            print("usage: owTempThread.py assign <spa|controller|air> <sensor id>")
+            sys.exit(1)
+        loadRoles()
+        sys.exit(setRole(sys.argv[2], sys.argv[3]))
+
     init()
     print
     print("Spa = ", getSpaTemp())
     print("Controller = ", getControllerTemp())
     print("Air = ", getAirTemp())
+
+    t = time.monotonic()
+    readAll()
+    print("bulk = %s, readAll took %.2f secs" % (bulk, time.monotonic() - t))
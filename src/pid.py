@@ -0,0 +1,191 @@
+#!/usr/bin/python
+#
+# pid.py
+# PID / time proportioning spa heater control
+#
+# Used by owTemp.thermostat when config.THERMOSTAT_MODE is
+# "pid". A PID output of 0..1 is the fraction of each
+# PID_WINDOW the heater is enabled. HEATER_LOCKOUT_TIME is
+# kept as a minimum on and off time: an on time shorter
+# than it is dropped, an off time shorter than it is
+# filled in, and the heater is never switched again
+# sooner than that.
+#
+# Anti-windup: the integral is held while the output is
+# saturated in the direction of the error, and kept
+# within 0..1. The derivative is taken on the temperature,
+# not the error, so setpoint changes don't kick it.
+#
+# Each finished window is kept in a short history with the
+# mean error, output and heater duty.
+#
+# version 1.0  18Oct26
+#
+# version 1.1  18Oct26  the simulation logs to the console
+#
+
+import time
+from collections import deque
+
+import config as c
+import log
+
+
+# module constants
+# secs without an update before the controller starts over
+RESET_GAP = 3 * c.THERMOSTAT_PERIOD
+
+
+# module globals
+integral = 0.0
+output = 0.0
+lastTemp = None
+lastTime = None
+heaterOn = False
+lastSwitch = None
+windowStart = 0.0
+
+# current window totals
+onSecs = 0.0
+errorSum = 0.0
+samples = 0
+switches = 0
+
+history = deque(maxlen=c.PID_HISTORY)
+
+
+
+def reset(now=None):
+    global integral, output, lastTemp, lastTime, windowStart
+
+    integral = 0.0
+    output = 0.0
+    lastTemp = None
+    lastTime = None
+    windowStart = now if now is not None else time.monotonic()
+    startWindow()
+    return
+
+
+
+def startWindow():
+    global onSecs, errorSum, samples, switches
+
+    onSecs = 0.0
+    errorSum = 0.0
+    samples = 0
+    switches = 0
+    return
+
+
+
+def endWindow(now):
+    global windowStart
+
+    history.append({'time':     time.strftime("%H:%M:%S"),
+                    'error':    round(errorSum / max(samples, 1), 2),
+                    'output':   round(output, 3),
+                    'integral': round(integral, 3),
+                    'duty':     round(onSecs / c.PID_WINDOW, 3),
+                    'switches': switches})
+    log.log(log.INFO, "pid window: " + str(history[-1]))
+
+    windowStart = now
+    startWindow()
+    return
+
+
+
+# PID output 0..1 for the spa temperature
+def compute(temp, setPoint, dt):
+    global integral, lastTemp
+
+    error = setPoint - temp
+    derivative = 0.0
+    if (lastTemp is not None and dt > 0):
+        derivative = -(temp - lastTemp) / dt
+    lastTemp = temp
+
+    proportional = c.PID_KP * error
+    trial = min(max(integral + c.PID_KI * error * dt, 0.0), 1.0)
+    out = proportional + trial + c.PID_KD * derivative
+
+    # don't wind up while the output is pinned
+    if (not ((out > 1.0 and error > 0) or (out < 0.0 and error < 0))):
+        integral = trial
+
+    return min(max(proportional + integral + c.PID_KD * derivative, 0.0), 1.0)
+
+
+
+# returns True if the heater should be enabled. isOn is the
+# heater's current state, now is time.monotonic()
+def demand(temp, setPoint, isOn, now):
+    global output, lastTime, heaterOn, lastSwitch
+    global onSecs, errorSum, samples, switches
+
+    if (lastTime is None or now - lastTime > RESET_GAP):
+        reset(now)
+        dt = 0.0
+    else:
+        dt = now - lastTime
+        if (heaterOn):
+            onSecs += dt
+
+    # switched by someone else (over temp, spa off)
+    if (isOn != heaterOn):
+        heaterOn = isOn
+        lastSwitch = now
+
+    lastTime = now
+    output = compute(temp, setPoint, dt)
+    errorSum += setPoint - temp
+    samples += 1
+
+    if (now - windowStart >= c.PID_WINDOW):
+        endWindow(now)
+
+    # on time for this window, rounded to the minimum on / off times
+    onTime = output * c.PID_WINDOW
+    if (onTime < c.HEATER_LOCKOUT_TIME):
+        onTime = 0.0
+    elif (c.PID_WINDOW - onTime < c.HEATER_LOCKOUT_TIME):
+        onTime = c.PID_WINDOW
+
+    want = (now - windowStart) < onTime
+
+    if (want != heaterOn):
+        if (lastSwitch is not None and now - lastSwitch < c.HEATER_LOCKOUT_TIME):
+            return heaterOn
+        heaterOn = want
+        lastSwitch = now
+        switches += 1
+
+    return heaterOn
+
+
+
+def getHistory():
+    return list(history)
+
+
+
+# ----- main ------------------------------------------------
+# crude spa model: the heater adds 6 F / hour, the spa loses 7%
+# of its difference to 60 F air per hour. 6 simulated hours
+if __name__ == '__main__':
+
+    log.initConsole()
+
+    temp = 95.0
+    now = 0.0
+    on = False
+    dt = c.THERMOSTAT_PERIOD
+    for step in range(int(6 * 3600 / dt)):
+        on = demand(temp, 100.0, on, now)
+        temp += ((6.0 if on else 0.0) - (temp - 60.0) * 0.07) * dt / 3600.0
+        now += dt
+
+    for h in getHistory():
+        print(h)
+    print("done")
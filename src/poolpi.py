@@ -7,11 +7,16 @@
 #  1.6.0 - addded capability to control valves independantly
 #  1.6.1 - bug fix for spa web control logic
 #  1.6.2 - fixed timer events so they don't turn off if in spa mode
+#  1.7.1 - main loop replaced with deadline driven task scheduler
+#  1.7.2 - optional asyncio runtime (config.USE_ASYNCIO)
+#  1.7.3 - web commands queued to the control loop (commands.py)
+#  1.7.4 - pijuice read apart from the power checks, equipment is
+#          shut down on every exit
 #
 # todo: fix pijuiuce status
 
-VERSION = "PoolPi 1.7.0"
-DATE    = "23Jul2020"
+VERSION = "PoolPi 1.7.4"
+DATE    = "18Oct2026"
 
 
 import sys
@@ -33,6 +38,9 @@ import owTemp as ow
 import util
 import redispy
 import webMain
+import scheduler
+import asyncCore
+import commands
 
 
 
@@ -48,6 +56,7 @@ NOERROR = cfg.NOERROR
 
 #module globals
 gv.loop = True
+webThread = None
 
 # ---------------------------------------------------
 
@@ -88,10 +97,12 @@ def setup():
     # init redis
     redispy.init()
 
-    # start temp sensor thread
+    # start temp sensor thread, the asyncio runtime samples
+    # the sensors itself
     ow.init()
-    if (ow.start() == ERROR):
-        return ERROR
+    if (not cfg.USE_ASYNCIO):
+        if (ow.start() == ERROR):
+            return ERROR
 
     log.log(log.ALWAYS, "setup() complete")
     return NOERROR
@@ -99,64 +110,44 @@ def setup():
 
 #-------------------------------------------------
 
+def addTasks():
+    scheduler.clearTasks()
+
+    # button presses and web commands wake the loop, so they are
+    # handled right away, always on the control loop
+    scheduler.addWakeHandler(commands.process)
+    scheduler.addWakeHandler(menu.mainLoopButtons)
+
+    # 1 second tasks
+    scheduler.addTask("timer",       cfg.STATUS_PERIOD,     timer.checkEvents)
+    scheduler.addTask("pijuice",     cfg.STATUS_PERIOD,     power.readStatus, resource="pijuice")
+    scheduler.addTask("power",       cfg.STATUS_PERIOD,     power.checkPowerStatus)
+    scheduler.addTask("display",     cfg.STATUS_PERIOD,     menu.statusDisplay)
+    scheduler.addTask("led",         cfg.STATUS_PERIOD,     equipment.toggleLED)
+    scheduler.addTask("redisStatus", cfg.STATUS_PERIOD,     redispy.setStatus, resource="redis")
+    scheduler.addTask("exitFile",    cfg.STATUS_PERIOD,     checkExitFile)
+
+    # 5 second task
+    scheduler.addTask("redisInfo",   cfg.INFO_PERIOD,       redispy.setInfo, resource="redis")
+
+    # 10 second task
+    scheduler.addTask("thermostat",  cfg.THERMOSTAT_PERIOD, thermostat)
+
+    # 60 second tasks
+    scheduler.addTask("cpuTemp",     cfg.HOUSEKEEP_PERIOD,  util.checkCPUtemp)
+    scheduler.addTask("freeze",      cfg.HOUSEKEEP_PERIOD,  ow.checkForFreeze)
+    scheduler.addTask("housekeep",   cfg.HOUSEKEEP_PERIOD,  housekeeping)
+    return
+
+
+
 def mainLoop():
 
     log.log(log.ALWAYS, "poolPi running main loop...")
-    lastSecs = 0
-
-    # main loop
-    while(gv.loop):
-        secs = int(time.mktime(time.localtime()))
-
-        # fast loop (millisecs)
-        # respond to button presses quickly
-        menu.mainLoopButtons()
-
-        if (gv.webUpdate == True):
-            ipc.update()
-
-        # 1 second loop
-        if (secs != lastSecs):
-            timer.checkEvents()
-            power.checkPowerStatus()
-            menu.statusDisplay()
-            equipment.toggleLED()
-            redispy.setStatus()
-
-            # 5 second loop
-            if (secs % 5 == 0):
-                redispy.setInfo()
-
-
-            # 10 second loop (move to 60 ?)
-            if (secs % 10 == 0):
-                if (gv.systemMode == cfg.SPA_ON):
-                    ow.thermostat()
-
-            # 60 second loop
-            if (secs % 60 == 0):
-                util.checkCPUtemp()
-                ow.checkForFreeze()
-
-                # dim lcd at night
-                if (checkTime(21, 0)):
-                   lcd.setBrightness(64)
-                elif (checkTime(6, 0)):
-                   lcd.setBrightness(255)
-
-                # at midnight, reset 1-wire errors
-                if (checkTime(0, 0)):
-                   ow.resetErrors()
-
-            # dev use - allows shutdown from console
-            # by creating the file 'sdpp' in pi home
-            if (util.fileExists()):
-                log.log(log.CRITICAL, "*** Exit Loop Detected ***")
-                gv.loop = False
-
-        lastSecs = secs
-        # make sure processor gets to rest (cpu goes to 100% otherwise ??)
-        time.sleep(0.25)
+
+    # sleeps until the next task deadline, returns when gv.loop is cleared
+    addTasks()
+    scheduler.run()
 
     # end of main loop
     log.log(log.CRITICAL, "exiting loop")
@@ -164,6 +155,37 @@ def mainLoop():
 
 
 
+def thermostat():
+    if (gv.systemMode == cfg.SPA_ON):
+        ow.thermostat()
+    return
+
+
+
+def housekeeping():
+    # dim lcd at night
+    if (checkTime(21, 0)):
+       lcd.setBrightness(64)
+    elif (checkTime(6, 0)):
+       lcd.setBrightness(255)
+
+    # at midnight, reset 1-wire errors
+    if (checkTime(0, 0)):
+       ow.resetErrors()
+    return
+
+
+
+# dev use - allows shutdown from console
+# by creating the file 'sdpp' in pi home
+def checkExitFile():
+    if (util.fileExists()):
+        log.log(log.CRITICAL, "*** Exit Loop Detected ***")
+        gv.loop = False
+    return
+
+
+
 def exitLoop():
     gv.loop = False
     return
@@ -182,16 +204,36 @@ def checkTime(hours, minutes):
 
 # -- start mail loop and threads ---------------------------------
 
+# stops the web server and waits a bounded time for its thread
+def stopWeb():
+    webMain.stop()
+    if (webThread is not None):
+        webThread.join(cfg.WEB_STOP_TIMEOUT)
+        if (webThread.is_alive()):
+            log.log(log.WARNING, "web server still has open connections, exiting anyway")
+    return
+
+
+
 def start():
+    global webThread
+
     try:
         if (setup() == NOERROR):
             if(cfg.START_FLASK):
                 # start flask as thread
                 print("Starting Flask as thread...")
-                thread = Thread(target=webMain.start)
-                thread.start()
+                webThread = Thread(target=webMain.start, daemon=True)
+                webThread.start()
                 log.log(log.ALWAYS, "Flask thread started")
 
+            if (cfg.USE_ASYNCIO):
+                addTasks()
+                asyncCore.run()
+                stopWeb()
+                equipment.shutdown()
+                return
+
             # wait for 1-wire thread to init
             secs = 0
             log.log(log.ALWAYS, "waiting on 1-wire init")
@@ -201,12 +243,15 @@ def start():
                 if (secs > 60):
                     log.log(log.CRITICAL, "Timeout waiting for 1-wire Bus Init")
                     gv.loop = False
+                    stopWeb()
                     equipment.shutdown()
                     return
 
             # start main loop
             gv.loop = True
             mainLoop()
+            stopWeb()
+            equipment.shutdown()
         else:
             print("Error during startup - check logs")
             equipment.shutdown()
@@ -215,6 +260,7 @@ def start():
     except KeyboardInterrupt:
         gv.loop = False
         log.log(log.CRITICAL, "Keyboard Interrupt detected, exiting");
+        stopWeb()
         equipment.shutdown()
 
     return
@@ -7,6 +7,10 @@
 #
 # version 1.2  23Jul20  updated to V1.4 of PiJuice Firmware
 #
+# version 1.3  18Oct26  readStatus() reads the pijuice into gv
+# (its own task and resource), checkPowerStatus() only acts on
+# that reading, on the control loop
+#
 
 
 import time
@@ -17,6 +21,8 @@ from subprocess import call
 import globalVars as gv
 import config as c
 import log
+import lcd
+import equipment
 from pijuice import PiJuice
 
 
@@ -68,13 +74,26 @@ def resetFault():
     return
 
 
-# call tbis periodically to check power status (1 - 15 seconds)
-def checkPowerStatus():
+# reads the power input and charge level into gv. the only
+# periodic pijuice reader, run under the "pijuice" resource
+def readStatus():
     if (not gv.piJuicePresent):
         return UNK
 
+    gv.powerInput = getPowerState()
+    gv.charge = getChargeLevel()
+    return gv.powerInput
+
+
+
+# call tbis periodically to check power status (1 - 15 seconds).
+# acts on the last readStatus(), doesn't touch the pijuice
+def checkPowerStatus():
+    if (not gv.piJuicePresent or gv.powerInput == UNK):
+        return UNK
+
     # on battery power?
-    if (getPowerState() == BATTERY_POWER):
+    if (gv.powerInput == BATTERY_POWER):
         # already shutdown?
         if (gv.powerStatus == AC_POWER):
             log.log(log.WARNING, "Power Failure Detected")
@@ -87,7 +106,7 @@ def checkPowerStatus():
             return BATTERY_POWER
         else:
             log.log(log.WARNING, "Power Failure Detected")
-            log.log(log.WARNING, "Battery at " + str(getChargeStatus()))
+            log.log(log.WARNING, "Battery at " + str(gv.charge))
             return BATTERY_POWER
     else:
         # on AC
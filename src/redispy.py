@@ -1,4 +1,22 @@
-import datetime
+#!/usr/bin/python
+#
+# redispy.py
+# publishes controller state to redis for the web pages
+#
+# version 1.1  18Oct26  only keys whose value changed since the
+# last publish are sent, in one pipelined round trip
+#
+# version 1.2  18Oct26  state is kept in one redis hash with a
+# version counter that is bumped on every change, so readers can
+# fetch everything with one HGETALL and skip it if nothing changed
+#
+# version 1.3  18Oct26  event times come from the timer event heap
+#
+# version 1.4  18Oct26  the age of each sensor reading (secs) is
+# published, controller temp stays under 'cput'
+#
+
+import subprocess
 import redis
 import globalVars as gv
 import config as cfg
@@ -29,6 +47,9 @@ VALVE_DRAIN_MODE = 3  # CCW, CW
 # globals
 r = 0   #redis.Redis(host='localhost', port=6379, db=0)
 
+# last value published for each key, as the string redis stores
+published = {}
+
 
 
 def init():
@@ -40,68 +61,100 @@ def init():
 
 
 
-def setStatus():
+# send the keys in values that changed since they were last
+# published, returns the number of keys sent
+def publish(values):
     global r
 
-    r.set('at',gv.airTemp)
-    r.set('st',gv.spaTemp)
-    r.set('sp',gv.spaSetPoint)
-    r.set('sm',cfg.MODE_NAMES[gv.systemMode])
-    r.set('pp',gv.pumpPower)
-    r.set('hp',gv.heatPower)
-    r.set('he',gv.heatEnable)
-    r.set('vm',gv.valveMode)
-    r.set('tr',timer.getTimeRemaining())
+    changed = {}
+    for key in values:
+        value = str(values[key])
+        if (published.get(key) != value):
+            changed[key] = value
+
+    if (len(changed) == 0):
+        return 0
+
+    try:
+        # MULTI so readers never see a version without its values
+        pipe = r.pipeline(transaction=True)
+        pipe.hset(cfg.REDIS_STATE_KEY, mapping=changed)
+        pipe.incr(cfg.REDIS_VERSION_KEY)
+        pipe.execute()
+
+    except redis.RedisError as e:
+        # redis may have restarted and lost everything, resend it all next time
+        log.log(log.ERROR, "redis publish failed: " + str(e))
+        published.clear()
+        return 0
+
+    published.update(changed)
+    return len(changed)
+
+
+
+def setStatus():
+    values = {
+        'at': gv.airTemp,
+        'st': gv.spaTemp,
+        'sp': gv.spaSetPoint,
+        'sm': cfg.MODE_NAMES[gv.systemMode],
+        'pp': gv.pumpPower,
+        'hp': gv.heatPower,
+        'he': gv.heatEnable,
+        'vm': gv.valveMode,
+        'tr': timer.getTimeRemaining() }
+
+    n = publish(values)
     #printStatus()
-    print("Redis Status Updated")
+    log.log(log.DEBUG, "Redis Status Updated, %d keys" % n)
     return
 
 
 def setInfo():
-    global r
-
-    ts ='{0:%m-%d-%y %H:%M:%S}'.format(datetime.datetime.now())
-    batteryCharge = str(power.getChargeLevel()) + "%"
-    powerMode = str(power.getPowerState())
-
     try:
         bashCommand = "uptime"
-        uptime = subprocess.check_output(['bash','-c', bashCommand])
+        uptime = subprocess.check_output(['bash','-c', bashCommand]).decode()
         uptime = "current time = " + uptime
         log.log(log.DEBUG, uptime)
     except:
         uptime ="error"
 
-    r.set('te1on',str(timer.pumpOnTime1))
-    r.set('te1off',str(timer.pumpOffTime1))
-    r.set('te2on',str(timer.pumpOnTime2))
-    r.set('te2off',str(timer.pumpOffTime2))
-    r.set('te3off',str(timer.pumpOffTime3))
-    r.set('tsot',str(timer.spaOffTime))
-    r.set('lpo',str(timer.lastPumpOn))
-    r.set('npo',str(timer.nextPumpOffTime))
-
-    r.set('pjbc',gv.charge)
-    r.set('pjs',powerMode2str(powerMode))
-
-    r.set('ttr',"True")
-    r.set('cput',gv.controllerTemp)
-
-    r.set('owsd',ow.getDeviceID(0))
-    r.set('owcd',ow.getDeviceID(1))
-    r.set('owad',ow.getDeviceID(2))
-    r.set('owse',str(gv.owSpaErrors))
-    r.set('owce',str(gv.owCntrlErrors))
-    r.set('owae',str(gv.owAirErrors))
-
-
-    r.set('pjv', gv.pjfwVersion)
-    r.set('pjbc',gv.charge)
-    r.set('pjs', gv.powerStatus)
-
-    r.set('swv',cfg.VERSION)
-    r.set('cpus',uptime)
-    print("Redis Debug Updated")
+    values = {
+        'te1on':  timer.timeStr(timer.eventTime("pumpOn1")),
+        'te1off': timer.timeStr(timer.eventTime("pumpOff1")),
+        'te2on':  timer.timeStr(timer.eventTime("pumpOn2")),
+        'te2off': timer.timeStr(timer.eventTime("pumpOff2")),
+        'te3off': timer.timeStr(timer.eventTime("pumpOff3")),
+        'tsot':   timer.timeStr(timer.eventTime("spaOff")),
+        'lpo':    timer.timeStr(timer.lastPumpOn),
+        'npo':    timer.timeStr(timer.nextPumpOffTime),
+
+        'ttr':    "True",
+        'cput':   gv.controllerTemp,
+        'sta':    ow.ageStr(cfg.SPA_TEMP),
+        'ata':    ow.ageStr(cfg.AIR_TEMP),
+        'cta':    ow.ageStr(cfg.CONTROLLER_TEMP),
+
+        'owsd':   ow.getDeviceID(0),
+        'owcd':   ow.getDeviceID(1),
+        'owad':   ow.getDeviceID(2),
+        'owse':   str(gv.owSpaErrors),
+        'owce':   str(gv.owCntrlErrors),
+        'owae':   str(gv.owAirErrors),
+        'owsr':   str(gv.owSpaRejects),
+        'owcr':   str(gv.owCntrlRejects),
+        'owar':   str(gv.owAirRejects),
+
+        'pjv':    gv.pjfwVersion,
+        'pjbc':   gv.charge,
+        'pjs':    gv.powerStatus,
+
+        'swv':    cfg.VERSION,
+        'cpus':   uptime }
+
+    n = publish(values)
+    log.log(log.DEBUG, "Redis Debug Updated, %d keys" % n)
     return
 
 
@@ -112,15 +165,10 @@ def setInfo():
 def printStatus():
   global r
 
-  print('st = ' + r.get('st'))
-  print('at = ' + r.get('at'))
-  print('sp = ' + r.get('sp'))
-  print('sm = ' + r.get('sm'))
-  print('pp = ' + r.get('pp'))
-  print('hp = ' + r.get('hp'))
-  print('he = ' + r.get('he'))  
-  print('vm = ' + r.get('vm'))
-  print('tr = ' + r.get('tr'))
+  state = r.hgetall(cfg.REDIS_STATE_KEY)
+  print('version = ' + str(r.get(cfg.REDIS_VERSION_KEY)))
+  for key in ['st', 'at', 'sp', 'sm', 'pp', 'hp', 'he', 'vm', 'tr']:
+      print(key + ' = ' + str(state.get(key.encode())))
   print()
   return
 
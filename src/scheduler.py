@@ -0,0 +1,224 @@
+#!/usr/bin/python
+#
+# scheduler.py
+# deadline driven task scheduler for poolPi
+#
+# Each periodic task has its own period and its own
+# next deadline on the monotonic clock. Tasks are
+# kept in a heap ordered by deadline so the main
+# loop can sleep exactly until the next one is due.
+# A late task is run and rescheduled from its old
+# deadline so overruns are caught up, not dropped.
+#
+# version 1.0  18Oct26
+#
+# version 1.1  18Oct26  callLater() runs a one-shot step
+# after a delay (pump then heater on spa start) so the
+# caller doesn't sleep. Due steps run with the wake handlers.
+#
+
+import heapq
+import itertools
+import threading
+import time
+
+import config as c
+import globalVars as gv
+import log
+
+
+# module constants
+ERROR   = c.ERROR
+NOERROR = c.NOERROR
+
+# task entry fields
+DEADLINE = 0
+SEQ      = 1
+PERIOD   = 2
+NAME     = 3
+FUNC     = 4
+RESOURCE = 5
+
+# default resource, tasks that share a resource never run concurrently
+CONTROL  = "control"
+
+
+# module globals
+tasks = []                    # heap of [deadline, seq, period, name, func, resource]
+counter = itertools.count()   # tie breaker for equal deadlines
+
+# wake() cuts the main loop's sleep short so events (buttons,
+# commands) are handled right away, the wake handlers run on
+# every pass of the loop
+wakeEvent = threading.Event()
+wakeHandlers = []
+wakeHook = None               # set by the asyncio runtime
+
+# one-shot steps, heap of [deadline, seq, name, func]
+later = []
+
+
+
+def addTask(name, period, func, delay=0.0, resource=CONTROL):
+    if (period <= 0):
+        log.log(log.ERROR, "addTask: invalid period for task " + name)
+        return ERROR
+
+    entry = [time.monotonic() + delay, next(counter), period, name, func, resource]
+    heapq.heappush(tasks, entry)
+    log.log(log.DEBUG, "task %s added, period = %.2f secs" % (name, period))
+    return NOERROR
+
+
+
+def clearTasks():
+    global tasks, wakeHandlers, later
+    tasks = []
+    wakeHandlers = []
+    later = []
+    return
+
+
+
+# run func() once, delay secs from now, on the control loop
+def callLater(delay, name, func):
+    heapq.heappush(later, [time.monotonic() + delay, next(counter), name, func])
+    log.log(log.DEBUG, "step %s in %.2f secs" % (name, delay))
+    wake()
+    return NOERROR
+
+
+
+# secs until the next one-shot step is due, or limit
+def laterWait(limit):
+    if (len(later) == 0):
+        return limit
+    return max(0.0, min(limit, later[0][0] - time.monotonic()))
+
+
+
+def addWakeHandler(func):
+    wakeHandlers.append(func)
+    return NOERROR
+
+
+
+# safe to call from any thread
+def wake():
+    wakeEvent.set()
+    if (wakeHook is not None):
+        wakeHook()
+    return
+
+
+
+def runWakeHandlers():
+    now = time.monotonic()
+    while (len(later) > 0 and later[0][0] <= now):
+        entry = heapq.heappop(later)
+        try:
+            entry[3]()
+        except Exception as e:
+            log.log(log.ERROR, "step %s failed: %s" % (entry[2], str(e)))
+
+    for func in wakeHandlers:
+        try:
+            func()
+        except Exception as e:
+            log.log(log.ERROR, "wake handler failed: " + str(e))
+    return
+
+
+
+# returns a copy of the task table in deadline order
+def getTasks():
+    return sorted(tasks)
+
+
+
+def timeToNext():
+    if (len(tasks) == 0):
+        return laterWait(c.SCHED_MAX_SLEEP)
+
+    wait = tasks[0][DEADLINE] - time.monotonic()
+    if (wait < 0):
+        return 0.0
+    return laterWait(min(wait, c.SCHED_MAX_SLEEP))
+
+
+
+# run every task whose deadline has passed, returns
+# the number of task runs made
+def runPending():
+    runs = 0
+    now = time.monotonic()
+
+    while (len(tasks) > 0 and tasks[0][DEADLINE] <= now):
+        entry = tasks[0]
+        runTask(entry)
+        runs += 1
+
+        # reschedule from the old deadline so a late tick is
+        # caught up on the next pass instead of being skipped
+        entry[DEADLINE] += entry[PERIOD]
+
+        # if we are hopelessly behind (clock stall, long hardware
+        # hang), resync rather than firing a burst of stale runs
+        now = time.monotonic()
+        if (now - entry[DEADLINE] > entry[PERIOD] * c.SCHED_MAX_CATCHUP):
+            log.log(log.WARNING, "task %s behind by %.1f secs, resyncing" % (entry[NAME], now - entry[DEADLINE]))
+            entry[DEADLINE] = now + entry[PERIOD]
+
+        entry[SEQ] = next(counter)
+        heapq.heapreplace(tasks, entry)
+
+    return runs
+
+
+
+def runTask(entry):
+    try:
+        entry[FUNC]()
+    except Exception as e:
+        log.log(log.ERROR, "task %s failed: %s" % (entry[NAME], str(e)))
+    return
+
+
+
+# run tasks until gv.loop is cleared
+def run():
+    log.log(log.ALWAYS, "scheduler running %d tasks" % len(tasks))
+
+    while (gv.loop):
+        runWakeHandlers()
+        runPending()
+        wakeEvent.wait(timeToNext())
+        wakeEvent.clear()
+
+    log.log(log.CRITICAL, "scheduler exiting")
+    return
+
+
+
+#-------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    log.init()
+
+    def tick():
+        print("tick  %.3f" % time.monotonic())
+
+    def tock():
+        print("tock  %.3f" % time.monotonic())
+        time.sleep(1.2)
+
+    addTask("tick", 0.5, tick)
+    addTask("tock", 2.0, tock)
+
+    end = time.monotonic() + 10
+    while (time.monotonic() < end):
+        runPending()
+        time.sleep(timeToNext())
+
+    print("done")
@@ -0,0 +1,65 @@
+// live.js - live status updates for the main page
+// listens to /events and patches every element with a matching
+// data-field attribute. fields that change which controls are shown
+// (pump, heater, mode) reload the page instead.
+// v1.0 18Oct26
+// v1.1 18Oct26 a refused or failed stream (503 when the server has
+// too many) is retried with backoff, the page reloads once it is
+// back since it missed the changes in between
+
+(function () {
+  var RELOAD_FIELDS = ['pp', 'he', 'sm'];
+  var RETRY_MIN = 5000;
+  var RETRY_MAX = 60000;
+  var retry = RETRY_MIN;
+
+  if (!window.EventSource) {
+    setTimeout(function () { location.reload(); }, 5000);
+    return;
+  }
+
+  function connect(reconnect) {
+    var first = true;
+    var source = new EventSource('/events');
+
+    source.onmessage = function (e) {
+      var data = JSON.parse(e.data);
+      retry = RETRY_MIN;
+
+      if (reconnect) {
+        location.reload();
+        return;
+      }
+
+      // the first event is the full state, the page was rendered from it
+      if (!first) {
+        for (var i = 0; i < RELOAD_FIELDS.length; i++) {
+          if (RELOAD_FIELDS[i] in data) {
+            location.reload();
+            return;
+          }
+        }
+      }
+      first = false;
+
+      for (var key in data) {
+        var els = document.querySelectorAll('[data-field="' + key + '"]');
+        for (var j = 0; j < els.length; j++) {
+          els[j].textContent = data[key];
+        }
+      }
+    };
+
+    // the browser retries dropped connections itself, but gives up
+    // for good on a non-200 response
+    source.onerror = function () {
+      if (source.readyState === EventSource.CLOSED) {
+        source.close();
+        setTimeout(function () { connect(true); }, retry);
+        retry = Math.min(retry * 2, RETRY_MAX);
+      }
+    };
+  }
+
+  connect(false);
+})();
@@ -9,7 +9,7 @@
 #
 #
 
-# VERSION = "1.8  18Jul20"
+# VERSION = "2.1  18Oct26"
 
 #  4 events: 2 recurring, 1 manual, 1 spa off
 # version 1.1 added one-shot events to
@@ -17,11 +17,27 @@
 # re-triggering 24 hours later. ONCE of RECURRING
 # is passed to the call to make an events
 #
-# to do: when converting events to objects, the type
-# needs to be part of the item
+# version 2.0 events are kept in a heap keyed on the
+# absolute (epoch) time they are next due, so any number
+# of events can be set and checkEvents only looks at the
+# top of the heap. Every due event fires, not just the
+# first. Recurring times are worked out with mktime in
+# local time, so midnight and DST changes are handled.
+# A late pump-on still fires if its off time has not
+# passed yet (stall, restart mid-window), otherwise it
+# is skipped until the next day. Changing or clearing an
+# event bumps its generation, stale heap entries are
+# dropped when they reach the top.
+#
+# version 2.1 the pump schedule can be edited while running
+# (web page / api, through the command bus). It is saved to
+# config.SCHEDULE_FILE and loaded at init, config.event1/2
+# are only the defaults until a schedule has been saved.
 #
 
 from datetime import timedelta
+import heapq
+import itertools
 import time
 
 import config as c
@@ -29,6 +45,7 @@ import globalVars as gv
 import equipment
 import log
 import lcd
+import util
 
 
 
@@ -47,45 +64,257 @@ PUMP_OFF_EVENT = 2
 SPA_OFF_EVENT  = 3
 UNKNOWN_EVENT  = 4
 
+EVENT_NAMES = ["none", "pump on", "pump off", "spa off", "unknown"]
+
+# event 3 is the manual / cooldown pump off, not a schedule entry
+MANUAL_EVENT = 3
+MAX_DURATION = 24 * 60
+
+# heap entry fields
+WHEN = 0
+SEQ  = 1
+NAME = 2
+GEN  = 3
+
 
 # module globals
 # init time to the past
-zeroTime = 0    # timedelta(hours=0, minutes=0)
+zeroTime = 0
 
-pumpOnTime1   = zeroTime
-pumpOffTime1  = zeroTime
-pumpOnTime2   = zeroTime
-pumpOffTime2  = zeroTime
-pumpOnTime3   = zeroTime
-pumpOffTime3  = zeroTime
+# name -> event dict, heap of [when, seq, name, gen]
+events = {}
+eventQueue = []
+seq = itertools.count()
 
-spaOffTime = zeroTime
+# epoch secs, 0 when not set
 lastPumpOn = 0
 nextPumpOffTime = 0
 
+# pump schedule, entry number -> [hour, mins, duration mins]
+schedule = {}
+
 
 
 def init():
     clearAllEvents()
-    # set timer event 1 and 2 from config
-    setPumpTimerEvent(1, c.event1[0], c.event1[1], c.event1[2], RECURRING)
-    setPumpTimerEvent(2, c.event2[0], c.event2[1], c.event2[2], RECURRING)
+    loadSchedule()
+    return
+
+
+
+# load the saved schedule, or timer event 1 and 2 from config
+def loadSchedule():
+    schedule.clear()
+
+    data = util.readJson(c.SCHEDULE_FILE)
+    if (isinstance(data, dict) and isinstance(data.get('events'), list)):
+        entries = data['events']
+        log.log(log.ALWAYS, "schedule loaded from " + c.SCHEDULE_FILE)
+    else:
+        entries = [{'num': 1, 'hour': c.event1[0], 'mins': c.event1[1], 'dur': c.event1[2]},
+                   {'num': 2, 'hour': c.event2[0], 'mins': c.event2[1], 'dur': c.event2[2]}]
+
+    for e in entries:
+        try:
+            setScheduleEntry(int(e['num']), int(e['hour']), int(e['mins']), int(e['dur']), save=False)
+        except (KeyError, TypeError, ValueError):
+            log.log(log.ERROR, "bad schedule entry " + str(e))
+    return
+
+
+
+def saveSchedule():
+    entries = []
+    for num in sorted(schedule):
+        h, m, dur = schedule[num]
+        entries.append({'num': num, 'hour': h, 'mins': m, 'dur': dur})
+    return util.atomicWriteJson(c.SCHEDULE_FILE, {'events': entries})
+
+
+
+def getSchedule():
+    entries = []
+    for num, (h, m, dur) in sorted(list(schedule.items())):
+        entries.append({'num':  num,
+                        'hour': h,
+                        'mins': m,
+                        'dur':  dur,
+                        'on':   timeStr(eventTime("pumpOn%i" % num)),
+                        'off':  timeStr(eventTime("pumpOff%i" % num))})
+    return entries
+
+
+
+def checkScheduleEntry(h, m, dur):
+    return (0 <= h < 24 and 0 <= m < 60 and 0 < dur <= MAX_DURATION)
+
+
+
+# returns the new entry number, or NO_EVENT on bad input
+def addScheduleEntry(h, m, dur):
+    num = 1
+    while (num in schedule or num == MANUAL_EVENT):
+        num += 1
+
+    if (setScheduleEntry(num, h, m, dur) == ERROR):
+        return NO_EVENT
+    return num
+
+
+
+def editScheduleEntry(num, h, m, dur):
+    if (num not in schedule):
+        log.log(log.ERROR, "no schedule entry %i" % num)
+        return ERROR
+    return setScheduleEntry(num, h, m, dur)
+
+
+
+def deleteScheduleEntry(num):
+    if (num not in schedule):
+        log.log(log.ERROR, "no schedule entry %i" % num)
+        return ERROR
+
+    running = runningEntry(num)
+    removeEvent("pumpOn%i" % num)
+    removeEvent("pumpOff%i" % num)
+    del schedule[num]
+    log.log(log.ALWAYS, "schedule entry %i deleted" % num)
+
+    if (running):
+        followRun(num)
+    saveSchedule()
+    return NOERROR
+
+
+
+# add or replace a schedule entry, the live events change in place
+def setScheduleEntry(num, h, m, dur, save=True):
+    if (num == MANUAL_EVENT or not checkScheduleEntry(h, m, dur)):
+        log.log(log.ERROR, "bad schedule entry %i: %i:%i for %i mins" % (num, h, m, dur))
+        return ERROR
+
+    running = runningEntry(num)
+    setPumpTimerEvent(num, h, m, dur, RECURRING)
+    schedule[num] = [h, m, dur]
+
+    if (running):
+        followRun(num)
+    if (save):
+        saveSchedule()
+    return NOERROR
+
+
+
+# true if the pump is on because of schedule entry num
+def runningEntry(num):
+    return (gv.pumpPower == ON and nextPumpOffTime != zeroTime and
+            nextPumpOffTime == eventTime("pumpOff%i" % num))
+
+
+
+# after entry num changed under a running pump, keep running to the
+# new off time if the entry still covers now, else stop the run
+def followRun(num):
+    global nextPumpOffTime
+
+    if (num in schedule and eventTime("pumpOn%i" % num) <= time.time()):
+        nextPumpOffTime = eventTime("pumpOff%i" % num)
+        return
+
+    log.log(log.ALWAYS, "schedule entry %i changed, ending its pump run" % num)
+    if (gv.systemMode != c.SPA_ON):
+        equipment.pumpPower(OFF)
+    nextPumpOffTime = zeroTime
     return
 
 
 
 
 def timeNow():
-    # returns a timeDelta object
-    ts = time.localtime()
-    now = timedelta(hours = ts[3], minutes = ts[4], seconds = ts[5])
-    return now
+    return time.time()
 
 
 
-def setPumpTimerEvent(num, h, m, dur, type):
-    global pumpOnTime1, pumpOffTime1, pumpOnTime2, pumpOffTime2
+# first local time hour:mins after 'after' (epoch secs). mins may be
+# more than a day (start + duration), mktime normalizes it and picks
+# the right DST offset for the day
+def nextTime(hour, mins, after):
+    ts = time.localtime(after)
+    for day in range(-(mins // 1440) - 1, 2):
+        t = time.mktime((ts.tm_year, ts.tm_mon, ts.tm_mday + day, hour, mins, 0, 0, 0, -1))
+        if (t > after):
+            return t
+    return time.mktime((ts.tm_year, ts.tm_mon, ts.tm_mday + 2, hour, mins, 0, 0, 0, -1))
+
 
+
+def timeStr(t):
+    if (t == zeroTime):
+        return "--:--"
+    return time.strftime("%H:%M", time.localtime(t))
+
+
+
+# add or replace an event. recurring events have an hour and minute
+# (mins may run past midnight), one-shot events only a time. 'late'
+# is how many secs past due an event may still fire, None = always
+def addEvent(name, action, type, when, hour=0, mins=0, late=None, pair=None):
+    event = {'name':   name,
+             'action': action,
+             'type':   type,
+             'when':   when,
+             'hour':   hour,
+             'mins':   mins,
+             'late':   late,
+             'pair':   pair,
+             'gen':    next(seq)}
+
+    events[name] = event
+    heapq.heappush(eventQueue, [when, event['gen'], name, event['gen']])
+    log.log(log.DEBUG, "event %s set for %s" % (name, time.ctime(when)))
+    return event
+
+
+
+def removeEvent(name):
+    # heap entry is left behind and skipped when it reaches the top
+    if (events.pop(name, None) is not None):
+        log.log(log.DEBUG, "event %s cleared" % name)
+    return
+
+
+
+def moveEvent(name, when):
+    event = events.get(name)
+    if (event is None):
+        return ERROR
+    addEvent(name, event['action'], event['type'], when,
+             event['hour'], event['mins'], event['late'], event['pair'])
+    return NOERROR
+
+
+
+def eventTime(name):
+    event = events.get(name)
+    if (event is None):
+        return zeroTime
+    return event['when']
+
+
+
+def getEventInfo():
+    info = []
+    for event in sorted(list(events.values()), key=lambda e: e['when']):
+        info.append({'name':   event['name'],
+                     'action': EVENT_NAMES[event['action']],
+                     'type':   "recurring" if event['type'] == RECURRING else "once",
+                     'when':   time.strftime("%a %H:%M:%S", time.localtime(event['when']))})
+    return info
+
+
+
+def setPumpTimerEvent(num, h, m, dur, type):
     # setup event
     if (h >= 0 and h <= 24 and m >= 0 and m < 60):
         if (dur == 0):
@@ -94,23 +323,18 @@ def setPumpTimerEvent(num, h, m, dur, type):
 
         log.log(log.DEBUG, "Setting Event %i for %i:%i with duration %i" % (num, h, m, dur))
 
-        if (num == 1):
-            pumpOnTime1 = timedelta(hours=h, minutes=m)
-            pumpOffTime1  = timedelta(hours=h, minutes=m + dur)
-            log.log(log.ALWAYS, "setEvent1: pumpOnTime1 = " + str(pumpOnTime1))
-            log.log(log.ALWAYS, "setEvent1: pumpOffTime1 = " + str(pumpOffTime1))
-
-        elif (num == 2):
-            pumpOnTime2 = timedelta(hours=h, minutes=m)
-            pumpOffTime2  = timedelta(hours=h, minutes=m + dur)
-            log.log(log.ALWAYS, "setEvent2: pumpOnTime = " + str(pumpOnTime2))
-            log.log(log.ALWAYS, "setEvent2: pumpOffTime = " + str(pumpOffTime2))
-
-        elif (num == 3):
-            pumpOnTime3 = timedelta(hours=h, minutes=m)
-            pumpOffTime3  = timedelta(hours=h, minutes=m + dur)
-            log.log(log.ALWAYS, "setEvent3: pumpOnTime = " + str(pumpOnTime3))
-            log.log(log.ALWAYS, "setEvent3: pumpOffTime = " + str(pumpOffTime3))
+        # the on time may be up to dur in the past, so an event
+        # set (or a restart) inside its window turns the pump on now
+        now = time.time()
+        onName = "pumpOn%i" % num
+        offName = "pumpOff%i" % num
+        onTime = nextTime(h, m, now - dur * 60)
+        offTime = nextTime(h, m + dur, now)
+
+        addEvent(onName, PUMP_ON_EVENT, type, onTime, h, m, late=dur * 60, pair=offName)
+        addEvent(offName, PUMP_OFF_EVENT, type, offTime, h, m + dur)
+        log.log(log.ALWAYS, "setEvent%i: pumpOnTime = %s" % (num, time.ctime(onTime)))
+        log.log(log.ALWAYS, "setEvent%i: pumpOffTime = %s" % (num, time.ctime(offTime)))
         return NOERROR
     else:
         log.log(log.ERROR, "Error: setEvent Input Error h,m,dur = " + str(h) + "," + str(m) + "," + str(dur))
@@ -122,23 +346,22 @@ def setPumpTimerEvent(num, h, m, dur, type):
 # pumpOff events have no start time, pump assumed on and are always considered ONCE.
 # Use timer 3 so we don't overwrite the recurring events.
 def setPumpOffEvent(hrs, mins):
-    global pumpOffTime3, nextPumpOffTime
+    global nextPumpOffTime
 
     if (hrs > 0 or mins > 0):
-        ts = time.localtime()
-        pumpOffTime3  = timedelta(hours=ts[3] + hrs, minutes=ts[4] + mins)
-        nextPumpOffTime = pumpOffTime3
-        log.log(log.ALWAYS, "setPumpOffEvent3: Time = " + str(pumpOffTime3))
+        nextPumpOffTime = time.time() + hrs * 3600 + mins * 60
+        addEvent("pumpOff3", PUMP_OFF_EVENT, ONCE, nextPumpOffTime)
+        log.log(log.ALWAYS, "setPumpOffEvent3: Time = " + time.ctime(nextPumpOffTime))
         return NOERROR
     else:
-        log.log(log.ALWAYS, "Error: setPumpOffEvent3 time h = " + str(h) + " t = " + str(t))
+        log.log(log.ALWAYS, "Error: setPumpOffEvent3 time h = " + str(hrs) + " m = " + str(mins))
         return ERROR
 
 
 def clearPumpOffEvent():
-    global pumpOffTime3, nextPumpOffTime
+    global nextPumpOffTime
 
-    pumpOffTime3 = zeroTime
+    removeEvent("pumpOff3")
     nextPumpOffTime = zeroTime
     log.log(log.ALWAYS, "pumpOffTime3 cleared")
     return
@@ -148,124 +371,108 @@ def clearPumpOffEvent():
 # spa events have no start time, heater assumed on
 # spaOff events are always considered ONCE (i.e. one-shot)
 def setSpaOffEvent(hours):
-    global spaOffTime
-
     # event time cannot be 0 or longer than 12 hours
     if (hours > 0 and hours < 12):
-        ts = time.localtime()
-        spaOffTime  = timedelta(hours=ts[3] + hours, minutes=ts[4])
-        log.log(log.ALWAYS, "setSpaOffEvent:  = " + str(spaOffTime))
+        spaOffTime = time.time() + hours * 3600
+        addEvent("spaOff", SPA_OFF_EVENT, ONCE, spaOffTime)
+        log.log(log.ALWAYS, "setSpaOffEvent:  = " + time.ctime(spaOffTime))
         return NOERROR
 
     else:
-        log.log(log.ERROR, "Error: setSpaEvent Input Error hrs = " + str(hrs))
+        log.log(log.ERROR, "Error: setSpaEvent Input Error hrs = " + str(hours))
         return ERROR
 
 
 
 # increase spaOff events by 1 hour
 def incSpaOffTime():
-    global spaOffTime
+    if (moveEvent("spaOff", eventTime("spaOff") + 3600) == ERROR):
+        log.log(log.WARNING, "incSpaOff: no spa off event")
+        return ERROR
 
-    # event time cannot be 0 or longer than 12 hours
-    ts = time.localtime()
-    spaOffTime += timedelta(hours=1)
-    log.log(log.ALWAYS, "incSpaOff:  = " + str(spaOffTime))
+    log.log(log.ALWAYS, "incSpaOff:  = " + time.ctime(eventTime("spaOff")))
     return NOERROR
 
 
 
-def checkEvents():
-    global spaOffTime, pumpOnTime1, pumpOffTime1, pumpOnTime2, pumpOffTime2
-    global pumpOnTime3, pumpOffTime3, lastPumpOn, nextPumpOffTime
+def fireEvent(event):
+    global lastPumpOn, nextPumpOffTime
 
-    # get local time
-    now = timeNow()
-    #log.log("Checking events at " + str(now))
+    name = event['name']
 
-    # timer events return non-zero if executed
-    # ----------- timer set 1 ------------------
-    if (pumpOnTime1 == now):
-        log.log(log.ALWAYS, "PumpOnEvent1 fired")
+    if (event['action'] == PUMP_ON_EVENT):
+        log.log(log.ALWAYS, name + " fired")
         if (gv.pumpPower == OFF):
             equipment.pumpPower(ON)
-            lastPumpOn = pumpOnTime1
-            nextPumpOffTime = pumpOffTime1
-            return 1
-
-    if (pumpOffTime1 == now):
-        log.log(log.ALWAYS, "PumpOffEvent1 fired")
-        # don't turn off if in spa mode
-        if (gv.systemMode != c.SPA_ON):
+            lastPumpOn = event['when']
+            nextPumpOffTime = eventTime(event['pair'])
+
+    elif (event['action'] == PUMP_OFF_EVENT):
+        log.log(log.ALWAYS, name + " fired")
+        # one-shot (manual or cooldown) offs always turn the pump off,
+        # timer offs don't if in spa mode
+        if (event['type'] == ONCE or gv.systemMode != c.SPA_ON):
             equipment.pumpPower(OFF)
             nextPumpOffTime = zeroTime
-            return 2
+        if (event['type'] == ONCE):
+            lastPumpOn = zeroTime
 
+    elif (event['action'] == SPA_OFF_EVENT):
+        log.log(log.ALWAYS, "SpaOffEvent fired")
+        equipment.heaterEnable(OFF)
+        equipment.heaterPower(OFF)
 
-    # ------------timer set 2 -----------------
-    if (pumpOnTime2 == now):
-        log.log(log.ALWAYS, "PumpOnEvent2 fired")
-        if (gv.pumpPower == OFF):
-            equipment.pumpPower(ON)
-            lastPumpOnTime = pumpOnTime2
-            nextPumpOffTime = pumpOffTime2
-            return 3
-
-    if (pumpOffTime2 == now):
-        log.log(log.ALWAYS, "PumpOffEvent2 fired")
-        # don't turn off if in spa mode
-        if (gv.systemMode != c.SPA_ON):
-            equipment.pumpPower(OFF)
-            nextPumpOffTime = zeroTime
-            return 4
+        # set pump off time
+        setPumpOffEvent(0, 15)
+        log.log(log.ALWAYS, "PumpOffEvent3 set")
+        lcd.message("Pump will remain on for 15 minutes for cooldown", ttl=10)
+    return
 
 
 
-    # --------- set 3 manual or cooldown mode -------------------
-    # timer 3 has no on time event
-    if (pumpOffTime3 == now):
-        log.log(log.ALWAYS, "PumpOffEvent3 fired")
-        # if (gv.pumpPower == ON):
-        equipment.pumpPower(OFF)
-        lastPumpOn = zeroTime
-        nextPumpOffTime = zeroTime
-        # clear event to prevent a retrigger
-        pumpOffTime3 = zeroTime
-        return 6
+# fires every event that is due, returns how many fired
+def checkEvents():
+    now = time.time()
+    fired = 0
 
+    while (eventQueue and eventQueue[0][WHEN] <= now):
+        entry = heapq.heappop(eventQueue)
+        event = events.get(entry[NAME])
 
-    # ----------- spa off event -----------------
+        # changed or cleared since this entry was pushed
+        if (event is None or event['gen'] != entry[GEN]):
+            continue
 
-    if (spaOffTime == now):
-        log.log(log.ALWAYS, "SpaOffEvent fired")
-        equipment.heaterEnable(OFF)
-        equipment.heaterPower(OFF)
+        if (event['late'] is not None and now - event['when'] > event['late']):
+            log.log(log.WARNING, "%s missed at %s, skipping" % (event['name'], time.ctime(event['when'])))
+        else:
+            fireEvent(event)
+            fired += 1
 
-        # set pump off time & clear event
-        setPumpOffEvent(0, 15)
-        log.log(log.ALWAYS, "PumpOffEvent3 set")
-        spaOffTime = zeroTime
-        lcd.message("Pump will remain on for 15 minutes for cooldown")
-        time.sleep(10)
-        return 5
+        # fireEvent may have replaced this event
+        if (events.get(entry[NAME]) is not event):
+            continue
 
+        if (event['type'] == RECURRING):
+            # don't replay every missed day after a long stall
+            late = event['late'] or 0
+            after = max(event['when'], now - late)
+            moveEvent(event['name'], nextTime(event['hour'], event['mins'], after))
+        else:
+            removeEvent(event['name'])
 
-    # if nothing happened, return 0 (future)
-    return 0
+    return fired
 
 
 
 
 def clearAllEvents():
-    global pumpOnTime1, pumpOffTime1, pumpOnTime2, pumpOffTime2
-    global spaOffTime, pumpOnTime3, pumpOffTime3
+    global lastPumpOn, nextPumpOffTime
 
-    pumpOnTime1   = zeroTime
-    pumpOffTime1  = zeroTime
-    pumpOnTime2   = zeroTime
-    pumpOffTime2  = zeroTime
-    pumpOnTime3   = zeroTime
-    pumpOffTime3  = zeroTime
+    events.clear()
+    del eventQueue[:]
+    lastPumpOn = zeroTime
+    nextPumpOffTime = zeroTime
 
     log.log(log.INFO, "All Events Cleared")
     return
@@ -273,51 +480,30 @@ def clearAllEvents():
 
 
 def getTimeRemaining():
-    global nextPumpOffTime, spaOffTime
-
-    t1 = timeNow()
     remainingTime = "--:--:--"
     gv.remainingTime = remainingTime
 
-
     if (gv.systemMode == c.SPA_ON):
-        if (spaOffTime == 0):
-            return remainingTime
+        offTime = eventTime("spaOff")
+    elif (gv.systemMode in (c.PUMP_ON, c.COOLDOWN, c.MANUAL)):
+        offTime = nextPumpOffTime
     else:
-        if(nextPumpOffTime == 0):
-            return remainingTime
-
-    if (gv.systemMode == c.PUMP_ON):
-        remaining = nextPumpOffTime - t1
-        gv.remainingTime = str(remaining)
-        return str(remaining)
+        return remainingTime
 
-    elif (gv.systemMode == c.SPA_ON):
-        remaining = spaOffTime - t1
-        gv.remainingTime = str(remaining)
-        return str(remaining)
+    if (offTime == zeroTime):
+        return remainingTime
 
-    elif (gv.systemMode == c.COOLDOWN):
-        remaining = nextPumpOffTime - t1
-        gv.remainingTime = str(remaining)
-        return str(remaining)
-
-    elif (gv.systemMode == c.MANUAL):
-        remaining = nextPumpOffTime - t1
-        gv.remainingTime = str(remaining)
-        return str(remaining)
-
-    return remainingTime
+    remaining = str(timedelta(seconds=max(0, int(offTime - time.time()))))
+    gv.remainingTime = remaining
+    return remaining
 
 
 
 def setTimeRemaining(offTime):
     global lastPumpOn, nextPumpOffTime
 
-    ts = time.localtime()
-    now = timedelta(hours = ts[3], minutes = ts[4])
-    lastPumpOn = now
-    nextPumpOffTime = timedelta(hours = ts[3], minutes = ts[4] + offTime)
+    lastPumpOn = time.time()
+    nextPumpOffTime = lastPumpOn + offTime * 60
     return
 
 
@@ -329,5 +515,6 @@ if __name__ == '__main__':
 
     init()
     checkEvents()
+    for e in getEventInfo():
+        print(e)
     print("done")
-
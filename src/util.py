@@ -9,6 +9,7 @@
 import io
 import os
 import sys
+import json
 
 
 import config as c
@@ -45,6 +46,48 @@ def checkCPUtemp():
 
 
 
+# write data as json so a reader (or a power cut) sees either the
+# old file or the new one, never a partial write
+def atomicWriteJson(fileName, data):
+    tmpName = fileName + ".tmp"
+    try:
+        with open(tmpName, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpName, fileName)
+
+        # make the rename itself durable
+        dirFd = os.open(os.path.dirname(os.path.abspath(fileName)), os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+    except OSError as e:
+        log.log(log.ERROR, "unable to write " + fileName + ": " + str(e))
+        return ERROR
+
+    return NOERROR
+
+
+
+# returns default if the file is missing or unreadable
+def readJson(fileName, default=None):
+    try:
+        with open(fileName, 'r') as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return default
+
+    except (OSError, ValueError) as e:
+        log.log(log.ERROR, "unable to read " + fileName + ": " + str(e))
+        return default
+
+
+
+
 # debug tool to exit main loop
 def fileExists():
     f = '/home/pi/sdpp'
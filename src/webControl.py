@@ -5,6 +5,8 @@
 #
 # version 2.0  24jul20
 #
+# version 2.1  18Oct26  these run on the control loop, queued by
+# webMain through the command bus (commands.py)
 #
 #
 #
@@ -56,7 +58,7 @@ def tempControl(mode):
         if (gv.spaSetPoint > c.HEATER_MIN_TEMP):
             gv.spaSetPoint -= TEMP_STEP
             log.log(log.ALWAYS, "spa setpoint = "+ str(gv.spaSetPoint))
-    return
+    return gv.spaSetPoint
 
 
 
@@ -109,9 +111,9 @@ def valveControl(mode):
 
 def exit():
     log.log(log.ALWAYS, "web cmd: exit")
-    # set flag so main loop dies on next loop
+    # set flag so main loop dies on next loop, poolpi stops
+    # the web server once the loop has ended
     gv.loop = False
-    # how do i stop flask thread???
     return
 
 
@@ -5,18 +5,66 @@
 #
 #  version 1.3  23Jul20
 #
+#  version 1.4  18Oct26  pages read the controller state hash in
+#  one round trip and share the result while its version is current
+#
+#  version 1.5  18Oct26  /events streams changed status fields to
+#  the main page (server-sent events) instead of a meta refresh
+#
+#  version 1.6  18Oct26  /api/v1/status and /api/v1/info return the
+#  page fields as json, tagged with the state version as an ETag
+#
+#  version 1.7  18Oct26  served by waitress (bounded thread pool,
+#  keep-alive) when it is installed, and stop() shuts the server
+#  down so the program can exit
+#
+#  version 1.8  18Oct26  control routes submit to the command bus
+#  and return when the control loop has run the command, instead
+#  of calling the equipment from the web thread. POST
+#  /api/v1/command/<name> returns the command acknowledgement
+#
+#  version 1.9  18Oct26  pump schedule page and /api/v1/schedule
+#  list, add, edit and delete schedule entries while running
+#
+#  version 1.10  18Oct26  /api/v1/sensors lists the 1-wire sensors
+#  and assigns a sensor id to a role
+#
+#  version 1.11  18Oct26  /api/v1/thermostat returns the pid
+#  output and the recent per window heater records
+#
+#  version 1.12  18Oct26  stop() closes the waitress server on
+#  its own loop thread
+#
+#  version 1.13  18Oct26  api ETags are the redis run id plus the
+#  state version, checked against redis rather than the watcher
+#
 
 import time
 import datetime
 import subprocess
 import sys
 import logging
+import threading
+import json
 import redis
 
+import config as c
+import globalVars as gv
 import webControl
+import commands
+import timer
+import owTempThread
+import pid
 from threading import Thread
 
-from flask import Flask,flash,redirect,request,render_template,url_for,session,escape
+from flask import Flask,flash,redirect,request,render_template,url_for,session,escape,Response
+from werkzeug.serving import make_server
+
+# optional, falls back to the werkzeug server
+try:
+    import waitress
+except ImportError:
+    waitress = None
 
 
 app = Flask(__name__)
@@ -53,7 +101,111 @@ logging.basicConfig(format=logFormat, filename=logFileName, level=logging.DEBUG)
 logging.critical('Web start')
 
 
-r = redis.Redis(host='localhost', port=6379, db=0)
+r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+
+# fields shown on each page
+STATUS_FIELDS = ['at', 'st', 'sp', 'sm', 'pp', 'hp', 'he', 'vm', 'tr']
+INFO_FIELDS   = ['at', 'st', 'sp', 'cput', 'sta', 'ata', 'cta', 'sm', 'pp', 'hp', 'he', 'vm',
+                 'te1on', 'te1off', 'te2on', 'te2off', 'te3off', 'lpo', 'npo', 'tr',
+                 'pjbc', 'pjs',
+                 'owsd', 'owcd', 'owad', 'owse', 'owce', 'owae', 'owsr', 'owcr', 'owar',
+                 'swv', 'pjv', 'cpus']
+
+
+# decoded controller state shared by all requests, refreshed
+# only when the version published by redispy changes
+stateLock = threading.Lock()
+stateVersion = None
+stateCache = {}
+stateChecked = 0.0
+
+# redis server run id. the version counter starts over when redis
+# restarts without persistence, so ETags carry this as well
+stateEpoch = None
+
+# one watcher thread notices version changes and wakes every
+# /events stream, so viewers don't each poll redis
+stateChanged = threading.Condition()
+watcher = None
+
+# the running server and the number of open /events streams,
+# each stream holds a server thread
+server = None
+streams = 0
+
+# encoded api bodies for the current state version, by endpoint
+apiVersion = None
+apiCache = {}
+
+
+
+# returns (version, state) with state matching that version
+def getSnapshot():
+    global stateVersion, stateCache, stateChecked, stateEpoch
+
+    with stateLock:
+        # a burst of requests reuses the last check
+        now = time.monotonic()
+        if (stateVersion is not None and now - stateChecked < c.WEB_CACHE_TTL):
+            return stateVersion, stateCache
+
+        version = r.get(c.REDIS_VERSION_KEY)
+        if (version is None or version != stateVersion):
+            pipe = r.pipeline(transaction=True)
+            pipe.get(c.REDIS_VERSION_KEY)
+            pipe.hgetall(c.REDIS_STATE_KEY)
+            pipe.info('server')
+            stateVersion, stateCache, info = pipe.execute()
+            stateEpoch = str(info.get('run_id', ''))[:8]
+
+        stateChecked = now
+        return stateVersion, stateCache
+
+
+
+def getState():
+    return getSnapshot()[1]
+
+
+
+def watchState():
+    version = None
+    while (gv.loop):
+        try:
+            getState()
+        except redis.RedisError as e:
+            logging.error("state watcher: " + str(e))
+
+        if (stateVersion != version):
+            version = stateVersion
+            with stateChanged:
+                stateChanged.notify_all()
+
+        time.sleep(c.WEB_WATCH_PERIOD)
+    return
+
+
+
+def startWatcher():
+    global watcher
+
+    with stateLock:
+        if (watcher is None or not watcher.is_alive()):
+            watcher = Thread(target=watchState, name="webStateWatcher")
+            watcher.daemon = True
+            watcher.start()
+    return
+
+
+
+# dict of fields from the current state, plus a timestamp
+def getFields(fields):
+    state = getState()
+    data = {}
+    for key in fields:
+        data[key] = state.get(key)
+    data['ts'] = '{0:%m-%d-%y %H:%M:%S}'.format(datetime.datetime.now())
+    return data
 
 
 
@@ -65,19 +217,7 @@ r = redis.Redis(host='localhost', port=6379, db=0)
 @app.route('/')
 @app.route('/index.html')
 def index():
-    global r
-    
-    data = {'at':r.get('at'), 
-            'st':r.get('st'),
-            'sp':r.get('sp'),
-            'sm':r.get('sm'),
-            'pp':r.get('pp'),
-            'hp':r.get('hp'),
-            'he':r.get('he'),
-            'vm':r.get('vm'),
-            'ts':'{0:%m-%d-%y %H:%M:%S}'.format(datetime.datetime.now()),
-            'tr':r.get('tr')}
-
+    data = getFields(STATUS_FIELDS)
     return render_template('index.html', data=data)
 
 
@@ -85,43 +225,116 @@ def index():
 # status/debug page
 @app.route('/status.html')
 def status():
-    data = {
-            'at':r.get('at'), 
-            'st':r.get('st'),
-            'sp':r.get('sp'),
-            'ct':r.get('ct'),
-            'sm':r.get('sm'),
-            'pp':r.get('pp'),
-            'hp':r.get('hp'),
-            'he':r.get('he'),
-            'vm':r.get('vm'),
-                        
-            'te1on': r.get('te1on'),
-            'te1off':r.get('te1off'),
-            'te2on': r.get('te2on'),
-            'te2off':r.get('te2off'),
-            'te3off':r.get('te3off'),
-            'lpo':   r.get('lpo'),
-            'npo':   r.get('npo'),
-            'tr':    r.get('tr'),
-
-            'pjbc':r.get('pjbc'),
-            'pjs': r.get('pjs'),
-            
-            'owsd':r.get('owsd'),
-            'owcd':r.get('owcd'),
-            'owad':r.get('owad'),
-            'owse':r.get('owse'),
-            'owce':r.get('owce'),
-            'owae':r.get('owae'),
-            
-            'swv':r.get('swv'),
-            'pjv':r.get('pjv'),
-            'cpus':r.get('cpus')  }
-
+    data = getFields(INFO_FIELDS)
     return render_template('status.html', data=data)
 
 
+# live status stream for the main page. the first event has every
+# field, after that only fields that changed. a comment line is sent
+# when idle so proxies and browsers keep the connection open
+@app.route('/events')
+def events():
+    global streams
+
+    # leave threads free for pages, the browser retries later
+    with stateLock:
+        if (streams >= c.WEB_MAX_STREAMS):
+            return Response("too many streams", status=503, headers={'Retry-After': '10'})
+        streams += 1
+
+    startWatcher()
+
+    def endStream():
+        global streams
+        with stateLock:
+            streams -= 1
+        return
+
+    def changes():
+        sent = {}
+        version = None
+
+        while (gv.loop):
+            with stateChanged:
+                if (stateVersion == version):
+                    stateChanged.wait(c.WEB_KEEPALIVE)
+
+            if (stateVersion == version):
+                yield ": keepalive\n\n"
+                continue
+
+            version = stateVersion
+            data = getFields(STATUS_FIELDS)
+            diff = {}
+            for key in data:
+                if (sent.get(key) != data[key]):
+                    diff[key] = data[key]
+            sent.update(diff)
+
+            yield "id: %s\ndata: %s\n\n" % (version, json.dumps(diff, separators=(',', ':')))
+        return
+
+    resp = Response(changes(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resp.call_on_close(endStream)
+    return resp
+
+
+#---- json api ---------------------------------------------------------
+
+# redis holds strings, send numbers as numbers
+def jsonValue(v):
+    if (v is None):
+        return None
+    try:
+        return int(v)
+    except ValueError:
+        pass
+    try:
+        return float(v)
+    except ValueError:
+        return v
+
+
+
+def apiResponse(name, fields):
+    global apiVersion, apiCache
+
+    # a client that already has this version gets a 304 without any
+    # encoding. the version check is one GET, shared for WEB_CACHE_TTL
+    version, state = getSnapshot()
+    etag = "%s-%s" % (stateEpoch, version)
+    if (version is not None and request.if_none_match.contains(etag)):
+        return Response(status=304, headers={'ETag': '"%s"' % etag})
+
+    with stateLock:
+        if (apiVersion != version):
+            apiVersion = version
+            apiCache = {}
+
+        if (name not in apiCache):
+            data = {'version': jsonValue(version)}
+            for key in fields:
+                data[key] = jsonValue(state.get(key))
+            apiCache[name] = json.dumps(data, separators=(',', ':'))
+        body = apiCache[name]
+
+    return Response(body, mimetype='application/json',
+                    headers={'ETag': '"%s"' % etag, 'Cache-Control': 'no-cache'})
+
+
+
+@app.route('/api/v1/status')
+def apiStatus():
+    return apiResponse('status', STATUS_FIELDS)
+
+
+@app.route('/api/v1/info')
+def apiInfo():
+    return apiResponse('info', INFO_FIELDS)
+
+
+
 @app.route('/tools.html')
 def tools():
     # placeholders, not yet used in this version
@@ -156,92 +369,252 @@ def logs():
 #-----------------------------------------------------------------------
 
 
+# equipment changes go through the command bus so the control
+# loop stays the only owner of the hardware
+COMMANDS = {'pumpOff':    (webControl.pumpControl,  OFF),
+            'pumpOn':     (webControl.pumpControl,  ON),
+            'spaOff':     (webControl.spaControl,   OFF),
+            'spaOn':      (webControl.spaControl,   ON),
+            'valvesPool': (webControl.valveControl, VALVE_POOL_MODE),
+            'valvesSpa':  (webControl.valveControl, VALVE_SPA_MODE),
+            'incTemp':    (webControl.tempControl,  UP),
+            'decTemp':    (webControl.tempControl,  DOWN),
+            'incTime':    (webControl.timeAdjust,   UP),
+            'decTime':    (webControl.timeAdjust,   DOWN),
+            'exit':       (webControl.exit,),
+            'poweroff':   (webControl.powerOff,),
+            'reboot':     (webControl.reboot,)}
+
+ACK_STATUS = {commands.DONE:    200,
+              commands.FAILED:  500,
+              commands.REFUSED: 503,
+              commands.TIMEOUT: 504}
+
+
+
+def runCommand(name):
+    entry = COMMANDS[name]
+    return commands.run(name, entry[0], *entry[1:])
+
+
+
+def submitCommand(name):
+    entry = COMMANDS[name]
+    return commands.submit(name, entry[0], *entry[1:])
+
+
+
+@app.route('/api/v1/command/<name>', methods=['POST'])
+def apiCommand(name):
+    if (name not in COMMANDS):
+        return Response(json.dumps({'name': name, 'status': 'unknown'}),
+                        status=404, mimetype='application/json')
+
+    ack = runCommand(name)
+    return Response(json.dumps(ack, default=str), status=ACK_STATUS[ack['status']],
+                    mimetype='application/json')
+
+
+
+# hour, mins, dur from a json body or a form, None if missing or bad
+def scheduleArgs():
+    data = request.get_json(silent=True) or request.form
+    try:
+        return (int(data['hour']), int(data['mins']), int(data['dur']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+
+def jsonResponse(data, status=200):
+    return Response(json.dumps(data, default=str), status=status,
+                    mimetype='application/json')
+
+
+
+# run a command on the control loop. ok(result) says if it was
+# accepted, the reply is the command ack
+def checkedCommand(name, ok, func, *args):
+    ack = commands.run(name, func, *args)
+    status = ACK_STATUS[ack['status']]
+    if (ack['status'] == commands.DONE and not ok(ack['result'])):
+        status = 400
+    return ack, status
+
+
+
+@app.route('/api/v1/schedule', methods=['GET'])
+def apiSchedule():
+    return jsonResponse({'schedule': timer.getSchedule(), 'events': timer.getEventInfo()})
+
+
+
+@app.route('/api/v1/schedule', methods=['POST'])
+def apiScheduleAdd():
+    args = scheduleArgs()
+    if (args is None):
+        return jsonResponse({'status': 'bad request'}, 400)
+
+    ack, status = checkedCommand('scheduleAdd', lambda num: num != timer.NO_EVENT,
+                                  timer.addScheduleEntry, *args)
+    return jsonResponse(ack, 201 if status == 200 else status)
+
+
+
+@app.route('/api/v1/schedule/<int:num>', methods=['PUT'])
+def apiScheduleEdit(num):
+    args = scheduleArgs()
+    if (args is None):
+        return jsonResponse({'status': 'bad request'}, 400)
+
+    ack, status = checkedCommand('scheduleEdit', lambda err: err == NOERROR,
+                                  timer.editScheduleEntry, num, *args)
+    return jsonResponse(ack, status)
+
+
+
+@app.route('/api/v1/schedule/<int:num>', methods=['DELETE'])
+def apiScheduleDelete(num):
+    ack, status = checkedCommand('scheduleDelete', lambda err: err == NOERROR,
+                                  timer.deleteScheduleEntry, num)
+    return jsonResponse(ack, status)
+
+
+
+@app.route('/api/v1/sensors', methods=['GET'])
+def apiSensors():
+    return jsonResponse(owTempThread.getSensorInfo())
+
+
+
+# body {"id": "<sensor id>"}
+@app.route('/api/v1/sensors/<role>', methods=['PUT'])
+def apiSensorRole(role):
+    data = request.get_json(silent=True) or request.form
+    if ('id' not in data):
+        return jsonResponse({'status': 'bad request'}, 400)
+
+    ack, status = checkedCommand('sensorRole', lambda err: err == NOERROR,
+                                  owTempThread.setRole, role, data['id'])
+    return jsonResponse(ack, status)
+
+
+
+@app.route('/api/v1/thermostat', methods=['GET'])
+def apiThermostat():
+    return jsonResponse({'mode':     c.THERMOSTAT_MODE,
+                         'setpoint': gv.spaSetPoint,
+                         'output':   round(pid.output, 3),
+                         'cycles':   pid.getHistory()})
+
+
+
+@app.route('/schedule.html')
+def schedulePage():
+    return render_template('schedule.html', schedule=timer.getSchedule(),
+                           events=timer.getEventInfo())
+
+
+# html forms can only GET or POST
+@app.route('/schedule/add', methods=['POST'])
+def scheduleAdd():
+    args = scheduleArgs()
+    if (args is not None):
+        commands.run('scheduleAdd', timer.addScheduleEntry, *args)
+    return redirect(url_for('schedulePage'))
+
+
+@app.route('/schedule/<int:num>/edit', methods=['POST'])
+def scheduleEdit(num):
+    args = scheduleArgs()
+    if (args is not None):
+        commands.run('scheduleEdit', timer.editScheduleEntry, num, *args)
+    return redirect(url_for('schedulePage'))
+
+
+@app.route('/schedule/<int:num>/delete', methods=['POST'])
+def scheduleDelete(num):
+    commands.run('scheduleDelete', timer.deleteScheduleEntry, num)
+    return redirect(url_for('schedulePage'))
+
+
+
 @app.route('/pumpOff/')
 def pumpOff():
-    webControl.pumpControl(OFF)
-    time.sleep(0.5)
+    runCommand('pumpOff')
     return redirect(url_for('index'))
         
     
 @app.route('/pumpOn/')
 def pumpOn():
-    webControl.pumpControl(ON)
-    time.sleep(0.5)
+    runCommand('pumpOn')
     return redirect(url_for('index'))
 
 
 @app.route('/spaOff/')
 def spaOff():
-    webControl.spaControl(OFF)
-    time.sleep(0.5)
+    runCommand('spaOff')
     return redirect(url_for('index'))
 
 
 @app.route('/spaOn/')
 def spaOn():
-    webControl.spaControl(ON)
-    time.sleep(0.5)
+    runCommand('spaOn')
     return redirect(url_for('index'))
 
 
 @app.route('/valvesPool/')
 def valvesPool():
-    webControl.valveControl(VALVE_POOL_MODE)
-    time.sleep(0.5)
+    runCommand('valvesPool')
     return redirect(url_for('index'))
 
 
 @app.route('/valvesSpa/')
 def valvesSpa():
-    webControl.valveControl(VALVE_SPA_MODE)
-    time.sleep(0.5)
+    runCommand('valvesSpa')
     return redirect(url_for('index'))
 
 
 @app.route('/incTemp/')
 def incTemp():
-    webControl.tempControl(UP)
-    time.sleep(0.5)
+    runCommand('incTemp')
     return redirect(url_for('index'))
 
 
 @app.route('/decTemp/')
 def decTemp():
-    webControl.tempControl(DOWN)
-    time.sleep(0.5)
+    runCommand('decTemp')
     return redirect(url_for('index'))
 
 
 @app.route('/incTime/')
 def incTime():
-    webControl.timeAdjust(UP)
-    time.sleep(0.5)
+    runCommand('incTime')
     return redirect(url_for('index'))
 
 
 @app.route('/decTime/')
 def decTime():
-    webControl.timeAdjust(DOWN)
-    time.sleep(0.5)
+    runCommand('decTime')
     return redirect(url_for('index'))
 
 
 @app.route('/exit')
 def exit():
-    webControl.exit()
+    runCommand('exit')
     return 'exiting program'
 
 
+# these take the system down, so don't wait on them
 @app.route('/poweroff')
 def powerOff():
-    webControl.powerOff()
-    # should never get here
+    submitCommand('poweroff')
     return '<h1>Powering Down...</h1>'
 
 
 @app.route('/reboot')
 def reboot():
-    webControl.reboot()
+    submitCommand('reboot')
     return '<h1>Rebooting...</h1>'
 
 
@@ -261,13 +634,54 @@ def status2str(mode):
 
 
 def start():
-    print("start() - Running webMain without debugger")
+    global server
+
     flaskPort=5000
-    app.run(host='0.0.0.0', port=flaskPort)
+
+    if (c.WEB_SERVER == "waitress" and waitress is not None):
+        print("start() - Running webMain with waitress")
+        logging.critical("waitress, %d threads" % c.WEB_THREADS)
+        server = waitress.create_server(app, host='0.0.0.0', port=flaskPort,
+                                        threads=c.WEB_THREADS,
+                                        connection_limit=c.WEB_CONNECTION_LIMIT,
+                                        channel_timeout=c.WEB_CHANNEL_TIMEOUT)
+        # returns after stop() once the open connections have ended
+        server.run()
+
+    else:
+        if (c.WEB_SERVER == "waitress"):
+            logging.warning("waitress not installed, using the werkzeug server")
+        print("start() - Running webMain without debugger")
+        server = make_server('0.0.0.0', flaskPort, app, threaded=True)
+        server.serve_forever()
+
+    server = None
     print("webMain.py exiting")
     return
 
 
+
+# safe to call from any thread, start() returns once the server is down
+def stop():
+    s = server
+    if (s is None):
+        return
+
+    logging.critical("Web stop")
+    # wakes any /events streams so they see gv.loop is clear
+    with stateChanged:
+        stateChanged.notify_all()
+
+    if (waitress is not None and isinstance(s, waitress.server.BaseWSGIServer)):
+        # close() runs on the server's own loop thread. an idle
+        # keep-alive channel can keep run() going after it, poolpi's
+        # daemon thread and join timeout cover that
+        s.trigger.pull_trigger(s.close)
+    else:
+        s.shutdown()
+    return
+
+
 #---------------------------------------------
 if __name__ == '__main__':
 